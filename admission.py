@@ -0,0 +1,153 @@
+"""
+Admission control for write paths.
+
+SQLite serves one writer at a time, so extra concurrent writers only wait in
+the busy handler, retry, and time out in whatever order the lock happens to
+be released. An `AdmissionController` lets `max_concurrent` callers in at once,
+queues the rest in FIFO order, and turns them away early:
+
+- with `Overloaded` when `max_queue` callers are already waiting, or when the
+  expected wait (queue position x recent hold time) is longer than their
+  timeout
+- with `AdmissionTimeout` when their timeout passes while they are queued
+
+    admission = AdmissionController(max_concurrent=1, max_queue=64, timeout=5)
+    with admission.admit():
+        ...
+
+or, where admission is released elsewhere (possibly on another thread), with
+the token `acquire()` returns:
+
+    token = admission.acquire()
+    ...
+    admission.release(token)
+
+`snapshot()` reports queue depth, wait times and rejections.
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from utils import percentile
+
+
+class Overloaded(Exception):
+    """Rejected without queuing: too many callers are already waiting."""
+
+
+class AdmissionTimeout(TimeoutError):
+    """Queued for longer than the caller's timeout."""
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = 1,
+        max_queue: int = 64,
+        timeout: float = None,
+        window: int = 1000,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._mutex = threading.Lock()
+        self._waiters = deque()
+        self._active = 0
+        # Admission times of current holders, by the token acquire() gave them
+        self._holders = {}
+        self._tokens = itertools.count()
+        # Exponentially weighted mean of how long callers hold their admission
+        self._hold_time = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_depth = 0
+        # Most recent `window` wait times, in seconds
+        self.waits = deque(maxlen=window)
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    def estimated_wait(self) -> float:
+        """How long a caller arriving now would queue for, going by recent hold times."""
+        return (len(self._waiters) + 1) / self.max_concurrent * self._hold_time
+
+    def acquire(self, timeout: float = None) -> int:
+        """
+        Wait for admission, up to `timeout` seconds (default: the controller's).
+        Returns the token to `release()` it with.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        with self._mutex:
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                return self._admit(start)
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded(f"{len(self._waiters)} callers already queued")
+            if timeout is not None and self.estimated_wait() > timeout:
+                self.rejected += 1
+                raise Overloaded(
+                    f"Expected wait of {self.estimated_wait():.3f}s is over the {timeout}s timeout"
+                )
+            waiter = threading.Lock()
+            waiter.acquire()
+            self._waiters.append(waiter)
+            self.max_depth = max(self.max_depth, len(self._waiters))
+
+        if not waiter.acquire(timeout=-1 if timeout is None else timeout):
+            with self._mutex:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    self.timed_out += 1
+                    raise AdmissionTimeout(f"Not admitted within {timeout}s")
+            # release() handed over to us just as we timed out
+        with self._mutex:
+            return self._admit(start)
+
+    def _admit(self, start: float) -> int:
+        now = time.monotonic()
+        self.admitted += 1
+        self.waits.append(now - start)
+        token = next(self._tokens)
+        self._holders[token] = now
+        return token
+
+    def release(self, token: int):
+        with self._mutex:
+            admitted_at = self._holders.pop(token, None)
+            if admitted_at is not None:
+                self._hold_time += 0.1 * (time.monotonic() - admitted_at - self._hold_time)
+            if self._waiters:
+                # Hand the slot straight to the next in line
+                self._waiters.popleft().release()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def admit(self, timeout: float = None):
+        token = self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def snapshot(self) -> dict:
+        with self._mutex:
+            waits = sorted(w * 1000 for w in self.waits)
+            return {
+                "active": self._active,
+                "depth": len(self._waiters),
+                "max_depth": self.max_depth,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_p50_ms": percentile(waits, 50),
+                "wait_p99_ms": percentile(waits, 99),
+                "hold_ms": round(self._hold_time * 1000, 3),
+            }
@@ -0,0 +1,207 @@
+"""
+asyncio front end over a small, fixed set of connection-owning threads.
+
+Connections are opened with a zero busy timeout, so a locked database never
+blocks a worker thread in SQLite's busy handler. Instead, the awaiting coroutine
+backs off with `asyncio.sleep` and resubmits, until `busy_timeout` has elapsed.
+Lock waits therefore cost a suspended coroutine rather than a blocked thread, and
+can be cancelled or wrapped in `asyncio.wait_for`. Cancelling a call while its
+statement is running interrupts it.
+
+    db = AsyncDatabase(path)
+    rows = await db.fetchall("SELECT * FROM users")
+    async with db.transaction() as tx:
+        await tx.execute("INSERT INTO users (name) VALUES (?)", ("a",))
+    await db.close()
+"""
+
+import asyncio
+import queue
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+
+import utils
+
+
+class ExecuteResult(NamedTuple):
+    rowcount: int
+    lastrowid: int
+
+
+def _is_busy(e: Exception) -> bool:
+    return getattr(e, "sqlite_errorcode", None) == sqlite3.SQLITE_BUSY
+
+
+class _Job:
+    __slots__ = ("fn", "loop", "future", "conn")
+
+    def __init__(self, fn, loop, future):
+        self.fn = fn
+        self.loop = loop
+        self.future = future
+        # Set by the worker while the job is running
+        self.conn = None
+
+
+def _resolve(future, result, exc):
+    if future.done():
+        return
+    if exc is None:
+        future.set_result(result)
+    else:
+        future.set_exception(exc)
+
+
+def _run_job(conn: sqlite3.Connection, job: _Job):
+    if job.future.done():
+        # Cancelled while queued
+        return
+    job.conn = conn
+    try:
+        result, exc = job.fn(conn), None
+    except Exception as e:
+        result, exc = None, e
+    finally:
+        job.conn = None
+    job.loop.call_soon_threadsafe(_resolve, job.future, result, exc)
+
+
+class _Worker(threading.Thread):
+    def __init__(self, db_path, jobs: queue.SimpleQueue, connect_kwargs):
+        super().__init__(name="async-db-worker", daemon=True)
+        self.db_path = db_path
+        self.jobs = jobs
+        self.connect_kwargs = connect_kwargs
+
+    def run(self):
+        conn = utils.connect(
+            self.db_path,
+            isolation_level=None,
+            timeout=0,
+            check_same_thread=False,
+            **self.connect_kwargs,
+        )
+        try:
+            while (job := self.jobs.get()) is not None:
+                _run_job(conn, job)
+        finally:
+            conn.close()
+
+
+class _Executor:
+    """Shared by `AsyncDatabase` and `Transaction`: runs callables on a worker's connection."""
+
+    busy_timeout: float
+    busy_backoff: float
+    _jobs: queue.SimpleQueue
+
+    def _submit(self, job: _Job):
+        self._jobs.put(job)
+
+    async def _call(self, fn):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.busy_timeout
+        backoff = self.busy_backoff
+        while True:
+            job = _Job(fn, loop, loop.create_future())
+            self._submit(job)
+            try:
+                return await job.future
+            except asyncio.CancelledError:
+                conn = job.conn
+                if conn is not None:
+                    conn.interrupt()
+                raise
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or loop.time() + backoff > deadline:
+                    raise
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 0.1)
+
+    async def execute(self, sql: str, params=()) -> ExecuteResult:
+        def fn(conn):
+            cursor = conn.execute(sql, params)
+            return ExecuteResult(cursor.rowcount, cursor.lastrowid)
+
+        return await self._call(fn)
+
+    async def executemany(self, sql: str, seq_of_params) -> int:
+        seq_of_params = list(seq_of_params)
+        return await self._call(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        return await self._call(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql: str, params=()):
+        return await self._call(lambda conn: conn.execute(sql, params).fetchone())
+
+
+class Transaction(_Executor):
+    """Statements run on the single worker pinned for the transaction's lifetime."""
+
+    def __init__(self, busy_timeout: float, busy_backoff: float):
+        self.busy_timeout = busy_timeout
+        self.busy_backoff = busy_backoff
+        self._jobs = queue.SimpleQueue()
+
+
+class AsyncDatabase(_Executor):
+    def __init__(
+        self,
+        db_path,
+        workers: int = 4,
+        busy_timeout: float = 5.0,
+        busy_backoff: float = 0.001,
+        **connect_kwargs,
+    ):
+        self.busy_timeout = busy_timeout
+        self.busy_backoff = busy_backoff
+        self._jobs = queue.SimpleQueue()
+        self._workers = [
+            _Worker(db_path, self._jobs, connect_kwargs) for _ in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @asynccontextmanager
+    async def transaction(self, mode: str = "IMMEDIATE"):
+        """
+        Pin a worker and run `BEGIN <mode>` on it. Commits on exit, or rolls back
+        if the block raises (including on cancellation).
+        """
+        tx = Transaction(self.busy_timeout, self.busy_backoff)
+
+        def serve(conn):
+            # Runs on a worker, which then only serves this transaction until it ends
+            try:
+                while (job := tx._jobs.get()) is not None:
+                    _run_job(conn, job)
+            finally:
+                # Never hand the worker back with a transaction (and its locks) open
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+
+        loop = asyncio.get_running_loop()
+        self._submit(_Job(serve, loop, loop.create_future()))
+        try:
+            try:
+                # Inside the rollback scope: a cancellation can arrive after BEGIN
+                # has run on the worker, but before this coroutine resumes
+                await tx.execute(f"BEGIN {mode}")
+                yield tx
+                await tx.execute("COMMIT")
+            except BaseException:
+                # A failed statement may already have rolled the transaction back
+                await asyncio.shield(
+                    tx._call(lambda conn: conn.in_transaction and conn.execute("ROLLBACK"))
+                )
+                raise
+        finally:
+            tx._jobs.put(None)
+
+    async def close(self):
+        for _ in self._workers:
+            self._jobs.put(None)
+        await asyncio.to_thread(lambda: [w.join() for w in self._workers])
@@ -0,0 +1,344 @@
+"""
+Concurrency benchmark for sqlite3 using SQLAlchemy.
+
+Sweeps every combination of storage profile x processes x threads x pool size x journal_mode x
+synchronous x busy_timeout x write ratio. Each cell gets a fresh copy of a seeded database and
+runs for a fixed duration, recording:
+
+- commits/sec and reads/sec
+- p50/p95/p99 statement latency, read and write p50/p99, and a latency histogram
+- number of 'database is locked' errors
+- number of QueuePool timeouts
+
+With `--processes` above 1, each process opens its own engine against the same
+file, as separate Streamlit replicas would, so writers contend on POSIX file
+locks rather than on one process's sqlite3 mutexes and GIL. Threads run inside
+each process, so `--processes 4 --threads 1` is a pure process-pool run and
+`--processes 4 --threads 5` combines both.
+
+Results are written as JSON and CSV (with SQLite/Python versions) so runs can be
+compared across SQLite versions and config changes.
+
+Example:
+
+    python benchmark.py --threads 1 5 11 --pool-size 2 10 --journal-mode delete wal --duration 5
+    python benchmark.py --processes 1 2 4 8 --threads 1 --journal-mode wal
+    python benchmark.py --storage-profile none durable throughput read-heavy --rows 1000000
+"""
+
+import argparse
+import bisect
+import csv
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import create_engine, event, exc, text
+
+from utils import (
+    STORAGE_PROFILES,
+    apply_storage_profile,
+    bulk_load,
+    percentile,
+    template_db,
+)
+
+# Upper bounds (ms) of the latency histogram buckets, doubling from 0.05ms
+HISTOGRAM_BUCKETS = [0.05 * 2**i for i in range(18)]
+
+
+def histogram(values):
+    """Bucket latencies (ms) by HISTOGRAM_BUCKETS. Empty buckets are omitted."""
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for v in values:
+        counts[bisect.bisect_left(HISTOGRAM_BUCKETS, v)] += 1
+    labels = [f"<={b:g}ms" for b in HISTOGRAM_BUCKETS] + [f">{HISTOGRAM_BUCKETS[-1]:g}ms"]
+    return {label: c for label, c in zip(labels, counts) if c}
+
+
+def seed(db, rows: int):
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.close()
+    bulk_load(
+        db,
+        "users",
+        ["name"],
+        ((str(uuid.uuid4()),) for _ in range(rows)),
+        indexes=["CREATE UNIQUE INDEX users_name ON users (name)"],
+    )
+
+
+def run_process(
+    db,
+    storage_profile: str,
+    threads: int,
+    pool_size: int,
+    journal_mode: str,
+    synchronous: str,
+    busy_timeout: float,
+    write_ratio: float,
+    duration: float,
+    max_overflow: int,
+    pool_timeout: float,
+    rows: int,
+    start_at: float,
+):
+    """Run `threads` workers on their own engine, from `start_at` (wall clock) for `duration`."""
+    engine = create_engine(
+        f"sqlite:///{db}",
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        connect_args={"timeout": busy_timeout, "check_same_thread": False},
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        if storage_profile != "none":
+            # journal_mode was set with the profile when the cell's database was created
+            apply_storage_profile(dbapi_connection, storage_profile)
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.close()
+
+    lock = threading.Lock()
+    latencies = {"read": [], "write": []}
+    counts = {"commits": 0, "reads": 0, "locked": 0, "pool_timeouts": 0, "other_errors": 0}
+    # Processes are started one by one, so synchronize on the wall clock
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.monotonic() + duration
+
+    def worker():
+        local_latencies = {"read": [], "write": []}
+        local = dict.fromkeys(counts, 0)
+        rng = random.Random()
+        while time.monotonic() < deadline:
+            write = rng.random() < write_ratio
+            start = time.perf_counter()
+            try:
+                with engine.connect() as c:
+                    if write:
+                        c.execute(
+                            text("INSERT INTO users (name) VALUES (:name)"),
+                            {"name": str(uuid.uuid4())},
+                        )
+                        c.commit()
+                        local["commits"] += 1
+                    else:
+                        c.execute(
+                            text("SELECT name FROM users WHERE id = :id"),
+                            {"id": rng.randint(1, rows)},
+                        ).fetchall()
+                        local["reads"] += 1
+                local_latencies["write" if write else "read"].append(
+                    (time.perf_counter() - start) * 1000
+                )
+            except exc.TimeoutError:
+                local["pool_timeouts"] += 1
+            except exc.OperationalError as e:
+                if "database is locked" in str(e):
+                    local["locked"] += 1
+                else:
+                    local["other_errors"] += 1
+        with lock:
+            for k, v in local_latencies.items():
+                latencies[k].extend(v)
+            for k, v in local.items():
+                counts[k] += v
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.monotonic()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.monotonic() - start
+    engine.dispose()
+    return {"counts": counts, "latencies": latencies, "elapsed": elapsed}
+
+
+def run_cell(
+    db,
+    storage_profile: str,
+    processes: int,
+    threads: int,
+    pool_size: int,
+    journal_mode: str,
+    synchronous: str,
+    busy_timeout: float,
+    write_ratio: float,
+    duration: float,
+    max_overflow: int,
+    pool_timeout: float,
+    rows: int,
+):
+    """
+    Run `processes` processes of `threads` threads each. With more than one
+    process, every process opens its own engine, so writers contend on the
+    database's POSIX file locks rather than on one process's sqlite3 mutexes.
+    """
+    args = (
+        db,
+        storage_profile,
+        threads,
+        pool_size,
+        journal_mode,
+        synchronous,
+        busy_timeout,
+        write_ratio,
+        duration,
+        max_overflow,
+        pool_timeout,
+        rows,
+    )
+    if processes == 1:
+        parts = [run_process(*args, start_at=time.time())]
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(processes, mp_context=context) as pool:
+            # Leave time for the spawned interpreters to import their modules
+            start_at = time.time() + 1 + 0.2 * processes
+            parts = list(pool.map(run_process, *zip(*[args + (start_at,)] * processes)))
+
+    counts = {k: sum(p["counts"][k] for p in parts) for k in parts[0]["counts"]}
+    elapsed = max(p["elapsed"] for p in parts)
+    read_latencies = sorted(itertools.chain.from_iterable(p["latencies"]["read"] for p in parts))
+    write_latencies = sorted(itertools.chain.from_iterable(p["latencies"]["write"] for p in parts))
+    latencies = sorted(read_latencies + write_latencies)
+    if storage_profile != "none":
+        journal_mode = STORAGE_PROFILES[storage_profile]["journal_mode"]
+        synchronous = STORAGE_PROFILES[storage_profile]["synchronous"]
+    return {
+        "sqlite_version": sqlite3.sqlite_version,
+        "python_version": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "storage_profile": storage_profile,
+        "processes": processes,
+        "threads": threads,
+        "pool_size": pool_size,
+        "journal_mode": journal_mode,
+        "synchronous": synchronous,
+        "busy_timeout": busy_timeout,
+        "write_ratio": write_ratio,
+        "duration": round(elapsed, 3),
+        **counts,
+        "commits_per_sec": round(counts["commits"] / elapsed, 1),
+        "reads_per_sec": round(counts["reads"] / elapsed, 1),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "read_p50_ms": percentile(read_latencies, 50),
+        "read_p99_ms": percentile(read_latencies, 99),
+        "write_p50_ms": percentile(write_latencies, 50),
+        "write_p99_ms": percentile(write_latencies, 99),
+        "histogram": histogram(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--storage-profile",
+        nargs="+",
+        default=["none"],
+        choices=["none", *STORAGE_PROFILES],
+        help="utils.STORAGE_PROFILES to compare; profiles override --journal-mode/--synchronous",
+    )
+    parser.add_argument(
+        "--processes", type=int, nargs="+", default=[1], help="processes per cell"
+    )
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=[1, 5, 11], help="threads per process"
+    )
+    parser.add_argument("--pool-size", type=int, nargs="+", default=[2, 10])
+    parser.add_argument("--journal-mode", nargs="+", default=["delete", "wal"])
+    parser.add_argument("--synchronous", nargs="+", default=["full", "normal"])
+    parser.add_argument("--busy-timeout", type=float, nargs="+", default=[5.0], help="seconds")
+    parser.add_argument("--write-ratio", type=float, nargs="+", default=[0.1, 1.0])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per cell")
+    parser.add_argument("--rows", type=int, default=100_000, help="rows to seed")
+    parser.add_argument("--max-overflow", type=int, default=10)
+    parser.add_argument("--pool-timeout", type=float, default=5.0, help="seconds")
+    parser.add_argument("--out", default="benchmark_results", help="output path, without extension")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        results = []
+        cells = []
+        for storage_profile in args.storage_profile:
+            if storage_profile == "none":
+                modes = list(itertools.product(args.journal_mode, args.synchronous))
+            else:
+                # The profile sets both, so --journal-mode/--synchronous would only add duplicates
+                profile = STORAGE_PROFILES[storage_profile]
+                modes = [(profile["journal_mode"], profile["synchronous"])]
+            axes = itertools.product(
+                args.processes,
+                args.threads,
+                args.pool_size,
+                modes,
+                args.busy_timeout,
+                args.write_ratio,
+            )
+            for processes, threads, pool_size, mode, busy_timeout, write_ratio in axes:
+                cells.append(
+                    (storage_profile, processes, threads, pool_size, *mode, busy_timeout, write_ratio)
+                )
+        for i, cell in enumerate(cells, 1):
+            # Seeded once per row count and storage profile, then copied for every cell
+            template = template_db(
+                functools.partial(seed, rows=args.rows),
+                key=f"benchmark-users-{args.rows}",
+                storage_profile=None if cell[0] == "none" else cell[0],
+            )
+            db = Path(d) / f"cell_{i}.db"
+            shutil.copyfile(template, db)
+            result = run_cell(
+                db,
+                *cell,
+                duration=args.duration,
+                max_overflow=args.max_overflow,
+                pool_timeout=args.pool_timeout,
+                rows=args.rows,
+            )
+            results.append(result)
+            print(
+                f"[{i}/{len(cells)}] storage_profile={cell[0]} processes={cell[1]} "
+                f"threads={cell[2]} pool_size={cell[3]} journal_mode={result['journal_mode']} "
+                f"synchronous={result['synchronous']} busy_timeout={cell[6]} "
+                f"write_ratio={cell[7]}: "
+                f"{result['commits_per_sec']} commits/s, p99={result['p99_ms']}ms, "
+                f"locked={result['locked']}, pool_timeouts={result['pool_timeouts']}"
+            )
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{db}{suffix}").unlink(missing_ok=True)
+
+    out = Path(args.out)
+    out.with_suffix(".json").write_text(json.dumps(results, indent=2))
+    with open(out.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=[k for k in results[0] if k != "histogram"])
+        writer.writeheader()
+        for result in results:
+            writer.writerow({k: v for k, v in result.items() if k != "histogram"})
+    print(f"Wrote {out.with_suffix('.json')} and {out.with_suffix('.csv')}")
+
+
+if __name__ == "__main__":
+    main()
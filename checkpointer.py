@@ -0,0 +1,163 @@
+"""
+Background WAL checkpoint scheduler.
+
+With nonstop writers (as in `sqlalchemy_stress_test.start_inserts`), readers keep
+automatic checkpoints from completing, the WAL grows without bound, and read
+latency grows with it. The scheduler runs checkpoints from its own thread:
+
+- `PASSIVE` once no commits have been seen for `quiet_period` seconds
+- `RESTART` once the WAL has had uncheckpointed frames for `max_age` seconds,
+  so that writers start again from the beginning of the WAL
+- `TRUNCATE` once the WAL file is larger than `max_wal_bytes`
+
+`RESTART` and `TRUNCATE` wait up to `busy_timeout` for readers to finish, and
+new writers block for as long as they wait, so `busy_timeout` is kept short
+(50 ms). When one gives up busy, the next escalation waits `backoff` seconds,
+doubling on each further busy result up to `max_age`; only `PASSIVE`
+checkpoints, which never block writers, run in the meantime.
+
+Automatic checkpoints are per connection, so to keep them off request threads
+entirely, open writers with `PRAGMA wal_autocheckpoint=0`.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointScheduler:
+    def __init__(
+        self,
+        db_path,
+        interval: float = 1.0,
+        quiet_period: float = 2.0,
+        max_age: float = 30.0,
+        max_wal_bytes: int = 64 * 2**20,
+        busy_timeout: float = 0.05,
+        backoff: float = 1.0,
+    ):
+        self.db_path = db_path
+        self.wal_path = f"{db_path}-wal"
+        self.interval = interval
+        self.quiet_period = quiet_period
+        self.max_age = max_age
+        self.max_wal_bytes = max_wal_bytes
+        self.busy_timeout = busy_timeout
+        self.backoff = backoff
+        self.metrics = {
+            "wal_bytes": 0,
+            "wal_frames": 0,
+            "frames_checkpointed": 0,
+            "last_mode": None,
+            "last_duration": None,
+            "last_checkpoint_at": None,
+            "checkpoints": {"PASSIVE": 0, "RESTART": 0, "TRUNCATE": 0},
+            "busy": 0,
+        }
+        self._stop = threading.Event()
+        self._thread = None
+        self._data_version = None
+        self._last_change = time.monotonic()
+        self._dirty_since = None
+        # data_version as of the last checkpoint that emptied the WAL
+        self._clean_version = None
+        # No RESTART/TRUNCATE before this, after one gave up busy
+        self._escalate_after = 0.0
+        self._next_backoff = backoff
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="wal-checkpointer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        conn = utils.connect(
+            self.db_path,
+            isolation_level=None,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+        )
+        # This connection only checkpoints on our schedule
+        conn.execute("PRAGMA wal_autocheckpoint=0")
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    self.tick(conn)
+                except Exception:
+                    logger.exception("WAL checkpoint failed")
+        finally:
+            conn.close()
+
+    def tick(self, conn):
+        """Checkpoint if the WAL is due for one. Called every `interval`."""
+        now = time.monotonic()
+        # data_version changes whenever another connection commits
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._last_change = now
+
+        try:
+            wal_bytes = os.path.getsize(self.wal_path)
+        except FileNotFoundError:
+            wal_bytes = 0
+        self.metrics["wal_bytes"] = wal_bytes
+        if wal_bytes == 0 or data_version == self._clean_version:
+            self._dirty_since = None
+            return
+        if self._dirty_since is None:
+            self._dirty_since = now
+
+        if wal_bytes > self.max_wal_bytes:
+            mode = "TRUNCATE"
+        elif now - self._dirty_since > self.max_age:
+            mode = "RESTART"
+        elif now - self._last_change > self.quiet_period:
+            mode = "PASSIVE"
+        else:
+            return
+        if mode != "PASSIVE" and now < self._escalate_after:
+            mode = "PASSIVE"
+        self.checkpoint(conn, mode)
+
+    def checkpoint(self, conn, mode: str):
+        start = time.perf_counter()
+        # TRUNCATE reports 0 frames on success, as the WAL is then empty
+        busy, frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        duration = time.perf_counter() - start
+        m = self.metrics
+        m["wal_frames"] = frames
+        m["frames_checkpointed"] = checkpointed
+        m["last_mode"] = mode
+        m["last_duration"] = duration
+        m["last_checkpoint_at"] = time.time()
+        m["checkpoints"][mode] += 1
+        if mode != "PASSIVE":
+            if busy:
+                self._escalate_after = time.monotonic() + self._next_backoff
+                self._next_backoff = min(self._next_backoff * 2, self.max_age)
+            else:
+                self._next_backoff = self.backoff
+        if busy:
+            m["busy"] += 1
+        elif frames == checkpointed:
+            # Everything is in the database file; the WAL will be reused from the start
+            self._dirty_since = None
+            self._clean_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        try:
+            m["wal_bytes"] = os.path.getsize(self.wal_path)
+        except FileNotFoundError:
+            m["wal_bytes"] = 0
+        return busy, frames, checkpointed
@@ -0,0 +1,271 @@
+"""
+In-memory hot database with write-behind persistence.
+
+For small, hot tables (such as the per-request `users` upsert in
+pages/1_The_App.py), file locking costs more than the queries themselves. A
+`HotDatabase` loads the database file into memory with `Connection.backup()`
+(including anything still in its `-wal` file) and serves all reads and writes
+from there, through a single connection. A background thread persists it back to the file:
+
+- every `flush_interval` seconds, if anything was committed since the last flush
+- as soon as `flush_every` commits have piled up
+
+`method="serialize"` copies the database with `Connection.serialize()` (briefly
+blocking other queries) and writes the copy out; `method="backup"` copies it
+straight into a new file with `Connection.backup()`, blocking queries for the
+whole copy. Either way the new file is fsynced and renamed over the old one, so
+the file on disk is always a complete, consistent database.
+
+The durability window is `flush_interval` seconds or `flush_every` commits,
+whichever comes first: a crash loses at most the commits since the last flush.
+The `HotDatabase` must be the only user of the file while it is open.
+
+Needs Python 3.11+ for `serialize()`/`deserialize()`.
+
+    python hot_db.py --check      # kill -9 a writer mid-flight, then verify the file
+    python hot_db.py --benchmark  # compare with the file-backed utils.init_db database
+"""
+
+import argparse
+import logging
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+class HotDatabase:
+    def __init__(
+        self,
+        path,
+        schema: str = utils.USERS_SCHEMA,
+        flush_interval: float = 1.0,
+        flush_every: int = 1000,
+        method: str = "serialize",
+    ):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.method = method
+        if self.path.exists():
+            # Through a connection, so that frames still in the -wal file are read too
+            src = sqlite3.connect(self.path)
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+            try:
+                src.backup(self.conn)
+            finally:
+                # As the last connection, this checkpoints and removes the -wal
+                # file, so none is left over once a flush replaces the database
+                src.close()
+        else:
+            # A new database, persisted on the first flush
+            self.conn = utils.clone_memory(utils.template_db(schema), check_same_thread=False)
+        self.conn.isolation_level = None
+        self._lock = threading.Lock()
+        # Serializes flushes, which write to the same temporary file
+        self._flush_lock = threading.Lock()
+        self.commits = 0
+        self.persisted_commits = 0
+        self.flushes = 0
+        self.last_flush_duration = None
+        self.last_flush_bytes = None
+        self._flush_now = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hot-db-flush", daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def write(self, max_duration: float = 5.0):
+        """A write transaction (see `utils.write_transaction`), counted towards `flush_every`."""
+        with self._lock:
+            with utils.write_transaction(self.conn, max_duration):
+                yield self.conn
+            self.commits += 1
+            due = self.commits - self.persisted_commits >= self.flush_every
+        if due:
+            self._flush_now.set()
+
+    @contextmanager
+    def read(self, max_duration: float = 1.0):
+        """A read transaction (see `utils.read_transaction`)."""
+        with self._lock:
+            with utils.read_transaction(self.conn, max_duration):
+                yield self.conn
+
+    @property
+    def dirty(self) -> bool:
+        return self.commits != self.persisted_commits
+
+    def flush(self):
+        """Persist the database now, if anything has been committed since the last flush."""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        start = time.perf_counter()
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        with self._lock:
+            commits = self.commits
+            if commits == self.persisted_commits and self.path.exists():
+                return
+            if self.method == "serialize":
+                data = self.conn.serialize()
+            else:
+                dst = sqlite3.connect(tmp)
+                try:
+                    self.conn.backup(dst)
+                finally:
+                    dst.close()
+
+        if self.method == "serialize":
+            with open(tmp, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            fd = os.open(tmp, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        os.replace(tmp, self.path)
+        # Make the rename itself durable
+        dir_fd = os.open(self.path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        self.persisted_commits = commits
+        self.flushes += 1
+        self.last_flush_bytes = self.path.stat().st_size
+        self.last_flush_duration = time.perf_counter() - start
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._flush_now.wait(self.flush_interval)
+            self._flush_now.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Hot database flush failed")
+
+    def close(self):
+        """Stop the flush thread, persist anything outstanding, and close."""
+        self._stop.set()
+        self._flush_now.set()
+        self._thread.join()
+        self.flush()
+        self.conn.close()
+
+
+def _crash_child(path: str):
+    """Insert one row per commit until killed, printing the commits known to be on disk."""
+    db = HotDatabase(path, flush_interval=0.05, flush_every=200)
+    reported = 0
+    while True:
+        with db.write() as conn:
+            conn.execute("INSERT INTO users (name) VALUES (?)", (f"user {db.commits}",))
+        if db.persisted_commits != reported:
+            reported = db.persisted_commits
+            print(reported, flush=True)
+
+
+def check(rounds: int):
+    """Kill a writing process at random moments, and check what it left on disk."""
+    for i in range(rounds):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "hot.db"
+            child = subprocess.Popen(
+                [sys.executable, __file__, "--crash-child", str(path)],
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            persisted = 0
+            deadline = time.monotonic() + random.uniform(0.5, 2.0)
+            for line in child.stdout:
+                persisted = int(line)
+                if time.monotonic() > deadline:
+                    break
+            child.send_signal(signal.SIGKILL)
+            child.wait()
+            # Everything printed before the kill was already on disk
+            persisted = max([persisted, *(int(line) for line in child.stdout)])
+
+            conn = sqlite3.connect(path)
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            rows = conn.execute("SELECT count(*) FROM users").fetchone()[0]
+            conn.close()
+            ok = integrity == "ok" and rows >= persisted
+            print(
+                f"[{i + 1}/{rounds}] integrity={integrity} rows={rows} "
+                f"reported persisted={persisted}: {'ok' if ok else 'FAILED'}"
+            )
+            if not ok:
+                sys.exit(1)
+
+
+def benchmark(seconds: float):
+    """Single-row insert commits/sec, hot database vs the file-backed init_db database."""
+    with tempfile.TemporaryDirectory() as d:
+        conn = sqlite3.connect(utils.init_db(d), isolation_level=None)
+        results = {}
+        for name in ("file (rollback journal)", "file (WAL)", "hot"):
+            if name == "file (WAL)":
+                conn.execute("PRAGMA journal_mode=WAL")
+            if name == "hot":
+                db = HotDatabase(Path(d) / "hot.db")
+
+                def insert(i):
+                    with db.write() as c:
+                        c.execute("INSERT INTO users (name) VALUES (?)", (f"user {i}",))
+
+            else:
+
+                def insert(i):
+                    with utils.write_transaction(conn) as c:
+                        c.execute("INSERT INTO users (name) VALUES (?)", (f"user {i}",))
+
+            stop = time.monotonic() + seconds
+            count = 0
+            while time.monotonic() < stop:
+                insert(count)
+                count += 1
+            results[name] = count / seconds
+            if name == "hot":
+                db.close()
+                results[name + " flushes"] = db.flushes
+        conn.close()
+    for name, value in results.items():
+        print(f"{name}: {value:,.0f}" + ("" if "flushes" in name else " commits/s"))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--check", type=int, nargs="?", const=10, metavar="ROUNDS")
+    parser.add_argument("--benchmark", type=float, nargs="?", const=3.0, metavar="SECONDS")
+    parser.add_argument("--crash-child", metavar="PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.crash_child:
+        _crash_child(args.crash_child)
+    if args.check:
+        check(args.check)
+    if args.benchmark:
+        benchmark(args.benchmark)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Headless load test for the Streamlit pages.
+
+Runs the app's page scripts through Streamlit's `AppTest` (no browser, no
+server) from a growing number of concurrent simulated sessions. Each session is
+a process with its own `AppTest`, which keeps navigating through `--pages`
+until the step's `--duration` is up. (A Streamlit server would give each
+session's script run a thread instead, but `AppTest` runs swap process-wide
+state, such as the runtime instance and config options, so they cannot share a
+process.) Sessions start together once every process has loaded its app. Per
+step, it records:
+
+- page runs/sec, and p50/p95/p99 render latency overall and per page
+- exceptions shown on the page, and how many were lock errors
+  ('database is locked', 'database table is locked'); the overall lock error
+  count leaves out pages 3 and 7, which show one on every visit by design
+- runs that did not finish within `--timeout`
+
+The resulting saturation curve, and the smallest session count at which lock
+errors appeared, are printed and written as JSON and CSV.
+
+Note that `AppTest` gives every run a fresh in-memory cache, so `st.cache_data`
+and `st.cache_resource` never hit across runs. In particular, page 2 (and page
+10) run their scenario on every visit, instead of showing `scenarios.cached()`
+results as a server would, so their numbers are far worse than real visitors
+see; the results say so under `notes`.
+
+Example:
+
+    python load_test.py --sessions 1 2 4 8 16 --duration 20
+    python load_test.py --sessions 1 8 32 --pages pages/3_2_Threads,_Same_Connection.py
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+from utils import percentile
+
+ROOT = Path(__file__).resolve().parent
+MAIN_SCRIPT = ROOT / "Home.py"
+LOCK_ERRORS = ("database is locked", "database table is locked")
+
+
+def default_pages():
+    return [MAIN_SCRIPT] + sorted((ROOT / "pages").glob("[0-9]*.py"))
+
+
+# Pages that run a `scenarios` scenario, which AppTest never serves from cache
+UNCACHED_SCENARIO_PAGES = ("2_2_Threads,_Different_Connections.py", "10_Lock_Timeline.py")
+# Pages that show a lock error on every visit, to demonstrate it; not counted as load-induced
+LOCK_ERROR_DEMO_PAGES = ("3_2_Threads,_Same_Connection.py", "7_Misc:_Shared_Cache.py")
+
+
+def run_session(
+    session: int, pages, duration: float, timeout: float, think_time: float, start, results
+):
+    """One simulated visitor, navigating through `pages` for `duration` seconds."""
+    runs = []
+    try:
+        # Pages open files (such as error.jpg) relative to the app's directory, as `streamlit run` does
+        os.chdir(ROOT)
+        at = AppTest.from_file(str(MAIN_SCRIPT), default_timeout=timeout)
+        start.wait()
+        deadline = time.monotonic() + duration
+        # Start each session on a different page, so that not every session loads the same one
+        for i in itertools.count(session):
+            if time.monotonic() >= deadline:
+                break
+            page = pages[i % len(pages)]
+            at.switch_page(str(page.relative_to(ROOT)))
+            run_start = time.perf_counter()
+            errors = []
+            timed_out = False
+            try:
+                at.run()
+                errors = [str(e.message) for e in at.exception]
+            except RuntimeError as e:
+                # AppTest raises RuntimeError when the script run times out
+                timed_out = "timed out" in str(e).lower()
+                errors = [str(e)]
+            runs.append(
+                {
+                    "page": page.name,
+                    "ms": (time.perf_counter() - run_start) * 1000,
+                    "errors": errors,
+                    "timed_out": timed_out,
+                }
+            )
+            if think_time:
+                time.sleep(think_time)
+    except BaseException as e:
+        # Fail the whole step, rather than leave everyone waiting for this session
+        start.abort()
+        results.put(f"{type(e).__name__}: {e}")
+        raise
+    results.put(runs)
+
+
+def run_step(sessions: int, pages, duration: float, timeout: float, think_time: float):
+    """Run `sessions` concurrent sessions for `duration` seconds, and summarize."""
+    context = multiprocessing.get_context("spawn")
+    # Released once every session has loaded its app, and by the parent to time the step
+    start = context.Barrier(sessions + 1)
+    queue = context.Queue()
+    processes = [
+        context.Process(
+            target=run_session,
+            args=(i, pages, duration, timeout, think_time, start, queue),
+            name=f"session-{i}",
+        )
+        for i in range(sessions)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        start.wait()
+        started = time.monotonic()
+        # Drain the queue before joining, or a process blocked on a full pipe never exits
+        results = [queue.get() for _ in processes]
+        elapsed = time.monotonic() - started
+        failed = [r for r in results if isinstance(r, str)]
+        if failed:
+            raise RuntimeError(f"{len(failed)} session(s) failed, the first with {failed[0]}")
+    except threading.BrokenBarrierError:
+        raise RuntimeError("A session failed to start, see its traceback above") from None
+    finally:
+        for process in processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    runs = list(itertools.chain.from_iterable(results))
+    latencies = sorted(run["ms"] for run in runs)
+    per_page = {}
+    for page in pages:
+        page_runs = [run for run in runs if run["page"] == page.name]
+        page_latencies = sorted(run["ms"] for run in page_runs)
+        page_errors = list(itertools.chain.from_iterable(run["errors"] for run in page_runs))
+        per_page[page.name] = {
+            "runs": len(page_runs),
+            "p50_ms": percentile(page_latencies, 50),
+            "p95_ms": percentile(page_latencies, 95),
+            "p99_ms": percentile(page_latencies, 99),
+            "errors": len(page_errors),
+            "lock_errors": sum(any(s in e for s in LOCK_ERRORS) for e in page_errors),
+        }
+    return {
+        "sqlite_version": sqlite3.sqlite_version,
+        "python_version": platform.python_version(),
+        "sessions": sessions,
+        "duration": round(elapsed, 3),
+        "runs": len(runs),
+        "runs_per_sec": round(len(runs) / elapsed, 2),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "exceptions": sum(page["errors"] for page in per_page.values()),
+        "lock_errors": sum(
+            page["lock_errors"]
+            for name, page in per_page.items()
+            if name not in LOCK_ERROR_DEMO_PAGES
+        ),
+        "timeouts": sum(run["timed_out"] for run in runs),
+        "pages": per_page,
+        "notes": [
+            f"{page}: scenario re-run on every visit, bypassing scenarios.cached()"
+            for page in per_page
+            if page in UNCACHED_SCENARIO_PAGES
+        ]
+        + [
+            f"{page}: shows lock errors on purpose, left out of lock_errors"
+            for page in per_page
+            if page in LOCK_ERROR_DEMO_PAGES
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32],
+        help="concurrent sessions, one step each",
+    )
+    parser.add_argument(
+        "--pages", type=Path, nargs="+", help="page scripts to visit (default: all of them)"
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per step")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per page run")
+    parser.add_argument(
+        "--think-time", type=float, default=0.0, help="seconds between a session's page runs"
+    )
+    parser.add_argument("--out", default="load_test_results", help="output path, without extension")
+    args = parser.parse_args()
+
+    pages = [p.resolve() for p in args.pages] if args.pages else default_pages()
+    results = []
+    for sessions in args.sessions:
+        result = run_step(sessions, pages, args.duration, args.timeout, args.think_time)
+        results.append(result)
+        print(
+            f"sessions={sessions}: {result['runs_per_sec']} runs/s, "
+            f"p50={result['p50_ms']}ms, p95={result['p95_ms']}ms, "
+            f"exceptions={result['exceptions']}, lock_errors={result['lock_errors']}, "
+            f"timeouts={result['timeouts']}",
+            flush=True,
+        )
+
+    for note in results[0]["notes"]:
+        print(f"Note: {note}")
+    locked = [r["sessions"] for r in results if r["lock_errors"]]
+    if locked:
+        print(f"Lock errors first appeared at {min(locked)} concurrent sessions")
+    else:
+        print(f"No lock errors up to {max(args.sessions)} concurrent sessions")
+
+    out = Path(args.out)
+    out.with_suffix(".json").write_text(json.dumps(results, indent=2))
+    with open(out.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=[k for k in results[0] if k not in ("pages", "notes")]
+        )
+        writer.writeheader()
+        for result in results:
+            writer.writerow({k: v for k, v in result.items() if k not in ("pages", "notes")})
+    print(f"Wrote {out.with_suffix('.json')} and {out.with_suffix('.csv')}")
+
+
+if __name__ == "__main__":
+    main()
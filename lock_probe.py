@@ -0,0 +1,193 @@
+"""
+Non-blocking lock-state probe for live SQLite database files.
+
+Reports which of the states in pages/9_Appendix:_SQLite_Locking_in_Detail.py
+(UNLOCKED/SHARED/RESERVED/PENDING/EXCLUSIVE) a database file is in and which
+process holds it, by querying (never taking) POSIX locks on SQLite's lock bytes
+with `fcntl(F_GETLK)`. For WAL databases, the `-shm` file's lock bytes and
+wal-index header are inspected too. No SQLite connection is opened, so the probe
+cannot itself take a lock or start a transaction.
+
+Closing any file descriptor drops all of a process's POSIX locks on that file,
+including SQLite's own, so the probe keeps its descriptors open for the life of
+the process, unless the path has since been deleted or replaced (as SQLite does
+with `-shm`/`-wal` when the last connection closes, and `utils.template_db` and
+`hot_db` do by renaming): it then reopens the path, and closes the descriptor
+for the old file, whose locks no longer matter.
+
+On Linux, open file description locks (`F_OFD_GETLK`) are used, so locks held
+by the probing process itself are also reported.
+
+    python lock_probe.py path/to/db [--watch SECONDS] [--json]
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import struct
+import sys
+import time
+
+# Lock bytes used by SQLite's unix VFS (see os_unix.c / os.h)
+PENDING_BYTE = 0x40000000
+RESERVED_BYTE = PENDING_BYTE + 1
+SHARED_FIRST = PENDING_BYTE + 2
+SHARED_SIZE = 510
+
+# WAL-mode locks in the -shm file (see wal.c)
+WAL_LOCK_OFFSET = 120
+WAL_LOCKS = ["WRITE", "CHECKPOINT", "RECOVER"] + [f"READ{i}" for i in range(5)]
+WAL_DMS_BYTE = WAL_LOCK_OFFSET + len(WAL_LOCKS)
+# Offsets in the wal-index header: mxFrame in the first header copy, nBackfill
+# in the checkpoint info that follows both 48-byte copies
+WAL_MXFRAME_OFFSET = 16
+WAL_NBACKFILL_OFFSET = 96
+
+if sys.platform == "darwin":
+    _FLOCK = "qqihh"
+
+    def _pack(l_type, start, length):
+        return struct.pack(_FLOCK, start, length, 0, l_type, os.SEEK_SET)
+
+    def _unpack(data):
+        start, length, pid, l_type, _ = struct.unpack(_FLOCK, data)
+        return l_type, start, length, pid
+
+else:
+    _FLOCK = "hhqqi4x"
+
+    def _pack(l_type, start, length):
+        return struct.pack(_FLOCK, l_type, os.SEEK_SET, start, length, 0)
+
+    def _unpack(data):
+        l_type, _, start, length, pid = struct.unpack(_FLOCK, data)
+        return l_type, start, length, pid
+
+
+_GETLK = getattr(fcntl, "F_OFD_GETLK", fcntl.F_GETLK)
+
+# Only closed once their path is a different file, see the module docstring
+_fds = {}
+
+
+def _fd(path: str):
+    fd = _fds.get(path)
+    if fd is not None:
+        try:
+            current = os.stat(path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current == os.fstat(fd).st_ino:
+            return fd
+        # Deleted or replaced since it was opened
+        del _fds[path]
+        os.close(fd)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    _fds[path] = fd
+    return fd
+
+
+def query(fd: int, start: int, length: int = 1):
+    """
+    The first lock conflicting with a write lock on [start, start + length), as
+    ("read" | "write", pid), or None if the range is unlocked. pid is -1 for open
+    file description locks.
+    """
+    result = fcntl.fcntl(fd, _GETLK, _pack(fcntl.F_WRLCK, start, length))
+    l_type, _, _, pid = _unpack(result)
+    if l_type == fcntl.F_UNLCK:
+        return None
+    return ("read" if l_type == fcntl.F_RDLCK else "write", pid)
+
+
+def probe(path) -> dict:
+    """The lock state of the database at `path`, and of its WAL index if it has one."""
+    path = os.path.abspath(path)
+    fd = _fd(path)
+    if fd is None:
+        raise FileNotFoundError(path)
+
+    shared = query(fd, SHARED_FIRST, SHARED_SIZE)
+    pending = query(fd, PENDING_BYTE)
+    reserved = query(fd, RESERVED_BYTE)
+    holders = {}
+    if shared and shared[0] == "write":
+        state = "EXCLUSIVE"
+        holders["EXCLUSIVE"] = shared[1]
+    elif pending and pending[0] == "write":
+        state = "PENDING"
+    elif reserved:
+        state = "RESERVED"
+    elif shared:
+        state = "SHARED"
+    else:
+        state = "UNLOCKED"
+    if pending:
+        holders["PENDING"] = pending[1]
+    if reserved:
+        holders["RESERVED"] = reserved[1]
+    if shared and shared[0] == "read":
+        # F_GETLK reports one holder; there may be more
+        holders["SHARED"] = shared[1]
+
+    result = {"path": path, "state": state, "holders": holders, "wal": None}
+
+    shm_fd = _fd(path + "-shm")
+    if shm_fd is not None:
+        wal_locks = {}
+        for i, name in enumerate(WAL_LOCKS):
+            lock = query(shm_fd, WAL_LOCK_OFFSET + i)
+            if lock:
+                wal_locks[name] = {"type": lock[0], "pid": lock[1]}
+        header = os.pread(shm_fd, WAL_NBACKFILL_OFFSET + 4, 0)
+        wal = {
+            "locks": wal_locks,
+            # Every connection holds a read lock on this byte while it has the database open
+            "open": query(shm_fd, WAL_DMS_BYTE) is not None,
+        }
+        if len(header) == WAL_NBACKFILL_OFFSET + 4:
+            (wal["frames"],) = struct.unpack_from("=I", header, WAL_MXFRAME_OFFSET)
+            (wal["checkpointed"],) = struct.unpack_from("=I", header, WAL_NBACKFILL_OFFSET)
+        result["wal"] = wal
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("database")
+    parser.add_argument("--watch", type=float, help="probe every WATCH seconds")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per probe")
+    args = parser.parse_args()
+
+    while True:
+        result = probe(args.database)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            holders = ", ".join(f"{lock} by pid {pid}" for lock, pid in result["holders"].items())
+            line = f"{time.strftime('%H:%M:%S')} {result['state']}"
+            if holders:
+                line += f" ({holders})"
+            if result["wal"] is not None:
+                wal = result["wal"]
+                locks = ", ".join(
+                    f"{name} {lock['type']} by pid {lock['pid']}"
+                    for name, lock in wal["locks"].items()
+                )
+                line += f" | WAL frames={wal.get('frames')} checkpointed={wal.get('checkpointed')}"
+                if locks:
+                    line += f" locks: {locks}"
+            print(line, flush=True)
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
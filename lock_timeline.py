@@ -0,0 +1,251 @@
+"""
+Lock timeline recorder.
+
+Records, per connection and thread, the events that move a connection through
+SQLite's lock states (see pages/9_Appendix:_SQLite_Locking_in_Detail.py) into a
+fixed-size ring buffer:
+
+- BEGIN (with its mode), the first read and the first write of a transaction,
+  and COMMIT/ROLLBACK, from the connection's trace callback (see `tracing`)
+- BUSY, when a statement or `commit()` fails with a lock error, along with how
+  long it waited in the busy handler first (`seconds`)
+
+Statements outside a transaction are recorded as a READ or WRITE each.
+
+Python's sqlite3 does not expose the busy handler itself, so the time spent in
+it is only known for statements that end in BUSY, and BUSY is only recorded on
+`TimelineConnection`s. `utils.connect` opens those once `start()` has been
+called, unless the profiler is enabled, in which case only the trace events are
+recorded. `pages/10_Lock_Timeline.py` renders the buffer.
+"""
+
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from typing import NamedTuple
+
+from tracing import add_trace_callback
+
+WRITES = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER")
+
+
+class Event(NamedTuple):
+    time: float  # time.time()
+    connection: str
+    thread: str
+    kind: str  # BEGIN, READ, WRITE, COMMIT, ROLLBACK or BUSY
+    sql: str
+    seconds: float = None
+
+
+class _State:
+    __slots__ = ("read", "written")
+
+    def __init__(self):
+        self.read = False
+        self.written = False
+
+
+class TimelineRecorder:
+    def __init__(self, capacity: int = 10_000):
+        # deque.append is atomic, so recording takes no lock
+        self.events = deque(maxlen=capacity)
+
+    def record(self, conn, kind: str, sql: str, seconds: float = None):
+        self.events.append(
+            Event(
+                time.time(),
+                getattr(conn, "name", None) or f"{id(conn):#x}",
+                threading.current_thread().name,
+                kind,
+                sql,
+                seconds,
+            )
+        )
+
+    def watch(self, conn: sqlite3.Connection) -> sqlite3.Connection:
+        """Record `conn`'s transactions, through a trace callback."""
+        state = _State()
+        conn_ref = weakref.ref(conn)
+
+        def trace(sql: str):
+            conn = conn_ref()
+            if conn is None:
+                return
+            keyword = sql.lstrip()[:9].upper()
+            # Called before the statement runs, so this is the state before it
+            in_transaction = conn.in_transaction
+            if keyword.startswith("BEGIN") or (
+                keyword.startswith("SAVEPOINT") and not in_transaction
+            ):
+                state.read = state.written = False
+                self.record(conn, "BEGIN", sql)
+            elif keyword.startswith(("COMMIT", "END")):
+                self.record(conn, "COMMIT", sql)
+            elif keyword.startswith("ROLLBACK") and "TO" not in sql.upper().split()[1:3]:
+                self.record(conn, "ROLLBACK", sql)
+            elif keyword.startswith(WRITES):
+                if not in_transaction or not state.written:
+                    state.written = True
+                    self.record(conn, "WRITE", sql)
+            elif keyword.startswith(("SELECT", "WITH")):
+                if not in_transaction or not state.read:
+                    state.read = True
+                    self.record(conn, "READ", sql)
+
+        add_trace_callback(conn, trace)
+        if isinstance(conn, TimelineConnection):
+            conn.recorder = self
+        return conn
+
+    def snapshot(self) -> list:
+        return [event._asdict() for event in list(self.events)]
+
+    def clear(self):
+        self.events.clear()
+
+
+def _locked(e: sqlite3.OperationalError) -> bool:
+    return "locked" in str(e)
+
+
+class TimelineCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if _locked(e):
+                self.connection._busy(sql, time.perf_counter() - start)
+            raise
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            if _locked(e):
+                self.connection._busy(sql, time.perf_counter() - start)
+            raise
+
+
+class TimelineConnection(sqlite3.Connection):
+    """
+    A `sqlite3.Connection` that also records BUSY errors, to the recorder
+    watching it or else the active one. Set `name` to label it on the timeline.
+    """
+
+    name = None
+    recorder = None
+
+    def _busy(self, sql: str, seconds: float):
+        recorder = self.recorder or active
+        if recorder is not None:
+            recorder.record(self, "BUSY", sql, seconds)
+
+    def cursor(self, factory=TimelineCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            if _locked(e):
+                self._busy("COMMIT", time.perf_counter() - start)
+            raise
+
+
+def spans(events) -> list:
+    """
+    The lock each connection held over time, as `{connection, lock, start, end}`
+    rows, from events in time order. Time spent waiting before a BUSY error is
+    a row with lock "BUSY". Transactions still open end at the last event.
+    """
+    rows = []
+    open_spans = {}
+    # Lock changes traced as their statement started, which only happen if the
+    # next event on the connection is not a BUSY error: connection -> (kind, lock, at)
+    pending = {}
+    end = max((e["time"] for e in events), default=None)
+
+    def close(connection, at):
+        span = open_spans.pop(connection, None)
+        if span is not None:
+            rows.append({**span, "end": at})
+
+    def start(connection, lock, at):
+        close(connection, at)
+        if lock is not None:
+            open_spans[connection] = {"connection": connection, "lock": lock, "start": at}
+
+    for e in events:
+        connection, kind, at = e["connection"], e["kind"], e["time"]
+        change = pending.pop(connection, None)
+        if kind == "BUSY":
+            rows.append(
+                {"connection": connection, "lock": "BUSY", "start": at - e["seconds"], "end": at}
+            )
+            if change is not None and change[0] == "COMMIT":
+                # Got as far as PENDING, then could not get EXCLUSIVE
+                start(connection, "PENDING", change[2])
+            continue
+        if change is not None:
+            start(connection, change[1], change[2])
+
+        lock = open_spans.get(connection, {}).get("lock")
+        if kind == "BEGIN":
+            mode = e["sql"].upper()
+            if "IMMEDIATE" in mode:
+                pending[connection] = (kind, "RESERVED", at)
+            elif "EXCLUSIVE" in mode:
+                pending[connection] = (kind, "EXCLUSIVE", at)
+            else:
+                # DEFERRED: no lock until the first read or write
+                start(connection, "NONE", at)
+        elif kind == "COMMIT":
+            pending[connection] = (kind, None, at)
+        elif kind == "ROLLBACK":
+            close(connection, at)
+        elif lock is None:
+            # A statement outside a transaction, holding its lock only while it runs
+            rows.append(
+                {
+                    "connection": connection,
+                    "lock": "SHARED" if kind == "READ" else "RESERVED",
+                    "start": at,
+                    "end": at,
+                }
+            )
+        elif kind == "READ" and lock == "NONE":
+            start(connection, "SHARED", at)
+        elif kind == "WRITE" and lock in ("NONE", "SHARED"):
+            pending[connection] = (kind, "RESERVED", at)
+    for connection, (_, lock, at) in pending.items():
+        start(connection, lock, at)
+    for connection in list(open_spans):
+        close(connection, end)
+    return rows
+
+
+# Set by start(); read by utils.connect and TimelineConnection
+active = None
+
+
+def start(capacity: int = 10_000) -> TimelineRecorder:
+    global active
+    active = TimelineRecorder(capacity)
+    return active
+
+
+def stop():
+    global active
+    active = None
@@ -0,0 +1,97 @@
+import altair as alt
+import pandas as pd
+import streamlit as st
+
+import lock_timeline
+import scenarios
+
+st.title("Lock Timeline")
+
+st.write(
+    """
+    `lock_timeline` records, for each connection, when a transaction began, first read and first wrote, when it committed or rolled back, and when a statement failed with `database is locked` (and how long it waited in the busy handler first). From these, we can draw which lock each connection held over time.
+
+    _Each bar is a lock held by a connection; red bars are time spent waiting before a `BUSY` error. Zero-length bars are statements run outside a transaction, or transactions that ended immediately._
+    """
+)
+
+
+def render(events):
+    if not events:
+        st.write("_No events recorded yet._")
+        return
+    t0 = events[0]["time"]
+    spans = pd.DataFrame(lock_timeline.spans(events))
+    spans["start"] -= t0
+    # Keep zero-length spans visible
+    spans["end"] = (spans["end"] - t0).clip(lower=spans["start"] + 0.01)
+    chart = (
+        alt.Chart(spans)
+        .mark_bar()
+        .encode(
+            x=alt.X("start", title="Seconds"),
+            x2="end",
+            y=alt.Y("connection", title=None),
+            color=alt.Color(
+                "lock",
+                scale=alt.Scale(
+                    domain=["NONE", "SHARED", "RESERVED", "PENDING", "EXCLUSIVE", "BUSY"],
+                    range=["#d3d3d3", "#4c78a8", "#f58518", "#b279a2", "#54a24b", "#e45756"],
+                ),
+            ),
+            tooltip=["connection", "lock", "start", "end"],
+        )
+    )
+    st.altair_chart(chart)
+
+    with st.expander("Events"):
+        frame = pd.DataFrame(events)
+        frame["time"] -= t0
+        st.dataframe(frame, hide_index=True)
+
+
+st.header("The 2 threads deadlock")
+
+st.write(
+    """
+    The scenario from _2 Threads, Different Connections_, with its connections recorded. `conn2` keeps its `SHARED` lock while `conn1`, stuck at `PENDING` after its failed `commit()`, waits for it to go away, and `conn` cannot read at all until both commit.
+
+    _This scenario takes around 11 seconds to run, so the timeline below is from a cached run, made once per SQLite/Python version._
+    """
+)
+
+if st.button("Re-run live"):
+    result = scenarios.run_live("two_threads_different_connections_timeline")
+    if result is None:
+        st.warning("Too many live runs in progress, or the run took too long: showing the cached results instead.")
+        result = scenarios.cached("two_threads_different_connections_timeline")
+else:
+    result = scenarios.cached("two_threads_different_connections_timeline")
+
+st.caption(
+    f"Ran at {result['ran_at']} with SQLite `{result['versions']['sqlite']}` and Python `{result['versions']['python']}`."
+)
+render(result["events"])
+
+st.header("Live capture")
+
+st.write(
+    """
+    Once `lock_timeline.start()` has been called, every connection opened with `utils.connect` in this process is recorded, into a ring buffer of the most recent events.
+
+    Only those connections are captured: the ones behind `utils.Writer`, `utils.ConnectionPool`, `utils.streamlit_connection`, `sqlite_engine`, `async_db`, `replica` and `checkpointer`. The other pages and the scenarios above open theirs with `sqlite3.connect`, so clicking through them records nothing here; the timeline stays empty until code using one of those modules runs in this server process.
+    """
+)
+
+if lock_timeline.active is None:
+    if st.button("Start recording"):
+        lock_timeline.start()
+        st.rerun()
+else:
+    col1, col2 = st.columns(2)
+    if col1.button("Stop recording"):
+        lock_timeline.stop()
+        st.rerun()
+    if col2.button("Clear"):
+        lock_timeline.active.clear()
+    render(lock_timeline.active.snapshot())
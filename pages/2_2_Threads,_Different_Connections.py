@@ -1,11 +1,5 @@
 import streamlit as st
-from streamlit.runtime.scriptrunner import add_script_run_ctx
-import sqlite3
-import threading
-import time
-import uuid
-from utils import init_db
-import tempfile
+import scenarios
 
 
 st.title("2 Threads Using Different Connections")
@@ -14,159 +8,184 @@ st.write(
     """
     In this example, we have 2 threads which simultaneously read from the database, then attempt to write.
 
-    We first prepare the database with connection `conn`:
+    _This scenario takes around 6 seconds to run, so the results below are from a cached run, made once per SQLite/Python version._
     """
 )
 
-with tempfile.TemporaryDirectory() as d:
+if st.button("Re-run live"):
+    result = scenarios.run_live("two_threads_different_connections")
+    if result is None:
+        st.warning("Too many live runs in progress, or the run took too long: showing the cached results instead.")
+        result = scenarios.cached("two_threads_different_connections")
+else:
+    result = scenarios.cached("two_threads_different_connections")
 
-    db = init_db(d)
-
-    with st.echo():
-        conn = sqlite3.connect(db)
-
-    st.write(
-        "Then, we setup new connections `conn1` and `conn2` which will be used by threads 1 & 2 respectively:"
-    )
+st.caption(
+    f"Ran at {result['ran_at']} with SQLite `{result['versions']['sqlite']}` and Python `{result['versions']['python']}`."
+)
 
-    with st.echo():
+st.write("We first prepare the database with connection `conn`:")
 
-        conn1 = sqlite3.connect(
-            db,
-            check_same_thread=False,
-        )
-        conn2 = sqlite3.connect(
-            db,
-            check_same_thread=False,
-        )
+st.code(
+    """
+    conn = sqlite3.connect(db)
+    """
+)
 
-        def attempt_read_then_write(thread_conn: sqlite3.Connection, thread_num: int):
+st.write(
+    "Then, we setup new connections `conn1` and `conn2` which will be used by threads 1 & 2 respectively:"
+)
 
-            # Start a deferred transaction
-            thread_conn.execute("BEGIN")
+st.code(
+    """
+    conn1 = sqlite3.connect(
+        db,
+        check_same_thread=False,
+    )
+    conn2 = sqlite3.connect(
+        db,
+        check_same_thread=False,
+    )
 
-            thread_conn.execute("SELECT * FROM USERS;")
+    def attempt_read_then_write(thread_conn: sqlite3.Connection, thread_num: int):
 
-            # Ensure both threads have executed the SELECT before continuing
-            time.sleep(1)
+        # Start a deferred transaction
+        thread_conn.execute("BEGIN")
 
-            if thread_num == 2:
-                # Schedule thread2 to be just behind thread1
-                # thread2 will be holding the SHARED lock as a result
-                time.sleep(0.1)
+        thread_conn.execute("SELECT * FROM USERS;")
 
-            try:
-                # Before this INSERT, a BEGIN DEFERRED TRANSACTION is issued by the Python sqlite3 driver
-                thread_conn.execute(
-                    """INSERT INTO users (name) VALUES (?);""",
-                    (f"From Thread {thread_num}",),
-                )
+        # Ensure both threads have executed the SELECT before continuing
+        time.sleep(1)
 
-                # Attempt to obtain a PENDING then EXCLUSIVE lock
-                thread_conn.commit()
+        if thread_num == 2:
+            # Schedule thread2 to be just behind thread1
+            # thread2 will be holding the SHARED lock as a result
+            time.sleep(0.1)
 
-            except Exception as e:
-                st.write(
-                    f"Exception on `INSERT` from thread {thread_num} at {time.ctime()}",
-                    e,
-                )
+        try:
+            # Before this INSERT, a BEGIN DEFERRED TRANSACTION is issued by the Python sqlite3 driver
+            thread_conn.execute(
+                \"\"\"INSERT INTO users (name) VALUES (?);\"\"\",
+                (f"From Thread {thread_num}",),
+            )
 
-        thread1 = threading.Thread(target=attempt_read_then_write, args=[conn1, 1])
-        thread2 = threading.Thread(target=attempt_read_then_write, args=[conn2, 2])
+            # Attempt to obtain a PENDING then EXCLUSIVE lock
+            thread_conn.commit()
 
-    # Streamlit-specific fix for displaying executed code (unrelated)
-    add_script_run_ctx(thread1)
-    add_script_run_ctx(thread2)
+        except Exception as e:
+            st.write(
+                f"Exception on `INSERT` from thread {thread_num} at {time.ctime()}",
+                e,
+            )
 
-    st.write("Start the threads:")
+    thread1 = threading.Thread(target=attempt_read_then_write, args=[conn1, 1])
+    thread2 = threading.Thread(target=attempt_read_then_write, args=[conn2, 2])
+    """
+)
 
-    with st.echo():
+st.write("Start the threads:")
 
-        thread1.start()
-        thread2.start()
-        thread1.join()
-        thread2.join()
+st.code(
+    """
+    thread1.start()
+    thread2.start()
+    thread1.join()
+    thread2.join()
+    """
+)
 
+for exception in sorted(result["exceptions"], key=lambda e: e["after"]):
     st.write(
-        """
-        Note that `thread2` has thrown an exception on the `INSERT`, while `thread1` has thrown an exception on the `commit()`.
-
-        This is because `thread1`, being ahead, has obtained a `RESERVED` lock. On the `commit()`, it successfully obtains a `PENDING` lock, but then tries to obtain an `EXCLUSIVE` lock, which fails. `thread2`, being behind, cannot obtain even a `RESERVED` lock, and so fails at the `INSERT`.
-
-        Also, note that `thread2` fails almost immediately, while `thread1` fail around 5s later.
-        """
+        f"Exception on `{exception['statement']}` from thread {exception['thread']}, {exception['after']}s after the threads started:",
+        exception["error"],
     )
 
-    with st.expander(
-        "Why is `thread2` failing immediately? Why is it not retrying with `busy_handler`?"
-    ):
-        st.write(
-            """
-            SQLite will not retry (call the `busy_handler`) when it [detects a possible deadlock scenario](https://sqlite.org/c3ref/busy_handler.html). Instead, it returns `SQLITE_BUSY` for the process that is holding a read lock (`thread2`), hoping that it will give up its read lock and let the other process proceed.
-            """
-        )
-
-    st.write(
-        "`conn1` can read the database as it is still holding a `SHARED` lock. In addition, note that it can see its own changes, while `conn2` cannot:"
-    )
+st.write(
+    """
+    Note that `thread2` has thrown an exception on the `INSERT`, while `thread1` has thrown an exception on the `commit()`.
 
-    with st.echo():
-        st.write(conn1.execute("SELECT * FROM users;").fetchall())
+    This is because `thread1`, being ahead, has obtained a `RESERVED` lock. On the `commit()`, it successfully obtains a `PENDING` lock, but then tries to obtain an `EXCLUSIVE` lock, which fails. `thread2`, being behind, cannot obtain even a `RESERVED` lock, and so fails at the `INSERT`.
 
-    with st.echo():
-        st.write(conn2.execute("SELECT * FROM users;").fetchall())
+    Also, note that `thread2` fails almost immediately, while `thread1` fail around 5s later.
+    """
+)
 
+with st.expander(
+    "Why is `thread2` failing immediately? Why is it not retrying with `busy_handler`?"
+):
     st.write(
         """
-        `conn` cannot read, since `conn1` is holding a `PENDING` lock:
+        SQLite will not retry (call the `busy_handler`) when it [detects a possible deadlock scenario](https://sqlite.org/c3ref/busy_handler.html). Instead, it returns `SQLITE_BUSY` for the process that is holding a read lock (`thread2`), hoping that it will give up its read lock and let the other process proceed.
         """
     )
 
-    with st.echo():
+st.write(
+    "`conn1` can read the database as it is still holding a `SHARED` lock. In addition, note that it can see its own changes, while `conn2` cannot:"
+)
 
-        try:
-            st.write(conn.execute("SELECT * FROM users;").fetchall())
-        except Exception as e:
-            st.write(e)
+st.code('st.write(conn1.execute("SELECT * FROM users;").fetchall())')
+st.write(result["conn1_rows"])
 
-    st.write(
-        f"""
-        _Note that both `thread1` and `thread2` are not running at this point (the locks are held by the connections, irrespective of the thread's status):_
+st.code('st.write(conn2.execute("SELECT * FROM users;").fetchall())')
+st.write(result["conn2_rows"])
 
-        - `{thread1.is_alive()=}`
-        - `{thread2.is_alive()=}`
-        """
-    )
+st.write(
+    """
+    `conn` cannot read, since `conn1` is holding a `PENDING` lock:
+    """
+)
 
-    st.write(
-        f"""
-        In order for the database to be accessible again, `conn2` (holding the `SHARED` lock) must first `commit()` (releasing the lock), followed by `conn1` (allowing it to write, and then releasing the lock).
-        """
-    )
+st.code(
+    """
+    try:
+        st.write(conn.execute("SELECT * FROM users;").fetchall())
+    except Exception as e:
+        st.write(e)
+    """
+)
+st.write(result["conn_read"])
 
-    with st.echo():
-        conn2.commit()
-        conn1.commit()
+st.write(
+    f"""
+    _Note that both `thread1` and `thread2` are not running at this point (the locks are held by the connections, irrespective of the thread's status):_
 
-    st.write(
-        f"""
-        Now, the database is `UNLOCKED`, and any connection can read/write. Also note that the `INSERT` by `conn1` is successful:
-        """
-    )
+    - `thread1.is_alive()={result['thread1_alive']}`
+    - `thread2.is_alive()={result['thread2_alive']}`
+    """
+)
 
-    with st.echo():
-        st.write(conn.execute("SELECT * FROM users;").fetchall())
+st.write(
+    """
+    In order for the database to be accessible again, `conn2` (holding the `SHARED` lock) must first `commit()` (releasing the lock), followed by `conn1` (allowing it to write, and then releasing the lock).
+    """
+)
 
-    st.write(
-        """
-        That being said, this is still not a likely explanation of what happened in the app, as without the explicit `thread_conn.execute("BEGIN")`, the `SHARED lock would only be obtained very briefly and released shortly thereafter. In testing with a large database and a slow query, `INSERT`s do not seem to block on `SELECT`s.
+st.code(
+    """
+    conn2.commit()
+    conn1.commit()
+    """
+)
 
-        We consider a different possibility next - 2 threads using the same connection.
-        """
-    )
+st.write(
+    """
+    Now, the database is `UNLOCKED`, and any connection can read/write. Also note that the `INSERT` by `conn1` is successful:
+    """
+)
 
-    st.page_link(
-        "pages/3_2_Threads,_Same_Connection.py",
-        label="Next: 2 Threads, Same Connection",
-        icon=":material/arrow_forward:",
-    )
+st.code('st.write(conn.execute("SELECT * FROM users;").fetchall())')
+st.write(result["rows_after_commit"])
+
+st.write(
+    """
+    That being said, this is still not a likely explanation of what happened in the app, as without the explicit `thread_conn.execute("BEGIN")`, the `SHARED lock would only be obtained very briefly and released shortly thereafter. In testing with a large database and a slow query, `INSERT`s do not seem to block on `SELECT`s.
+
+    We consider a different possibility next - 2 threads using the same connection.
+    """
+)
+
+st.page_link(
+    "pages/3_2_Threads,_Same_Connection.py",
+    label="Next: 2 Threads, Same Connection",
+    icon=":material/arrow_forward:",
+)
@@ -205,3 +205,5 @@ with tempfile.TemporaryDirectory() as d:
         # All locks are released, and the database is now in the UNLOCKED state
 
         st.write(conn.cursor().execute("SELECT * FROM users;").fetchall())
+
+st.page_link("pages/10_Lock_Timeline.py", label="Next: Lock Timeline", icon=":material/arrow_forward:")
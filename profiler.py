@@ -0,0 +1,200 @@
+"""
+Opt-in slow-statement profiler for sqlite3 and SQLAlchemy connections.
+
+Statements are aggregated by shape (SQL with literals replaced by `?`), recording
+call count, wall time, rows touched, how often they ran inside a transaction, and
+the number of SQLite VM steps (counted with a progress handler). The first time a
+shape exceeds `slow_threshold`, its `EXPLAIN QUERY PLAN` is captured.
+
+Timings cover `execute()`, which for a `SELECT` is the time to the first row;
+rows touched are only known for data modification statements, so VM steps are
+the better measure of read cost.
+
+Plain sqlite3 connections are instrumented via `ProfiledConnection`, which
+`utils.connect` uses once `enable()` has been called. SQLAlchemy engines are
+instrumented with `instrument_sqlalchemy()`.
+"""
+
+import functools
+import json
+import re
+import sqlite3
+import threading
+import time
+
+# The progress handler is called every this many VM instructions
+PROGRESS_STEPS = 1000
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def shape(sql: str) -> str:
+    """Normalize a statement so that calls differing only in literals aggregate together."""
+    sql = _LITERALS.sub("?", sql)
+    sql = _IN_LISTS.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip().rstrip(";")
+
+
+class StatementProfiler:
+    def __init__(self, slow_threshold: float = 0.1):
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(
+        self,
+        conn,
+        sql: str,
+        params,
+        seconds: float,
+        rows: int,
+        in_transaction: bool,
+        steps: int = 0,
+    ):
+        key = shape(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {
+                    "calls": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "rows": 0,
+                    "in_transaction": 0,
+                    "vm_steps": 0,
+                    "slow_calls": 0,
+                    "plan": None,
+                }
+            stats["calls"] += 1
+            stats["total_time"] += seconds
+            stats["max_time"] = max(stats["max_time"], seconds)
+            stats["rows"] += max(rows, 0)
+            stats["in_transaction"] += in_transaction
+            stats["vm_steps"] += steps
+            slow = seconds >= self.slow_threshold
+            if slow:
+                stats["slow_calls"] += 1
+            need_plan = slow and stats["plan"] is None
+            if need_plan:
+                # Mark as captured so concurrent slow calls don't all run EXPLAIN
+                stats["plan"] = []
+        if need_plan:
+            stats["plan"] = explain(conn, sql, params)
+
+    def snapshot(self):
+        """Per-shape stats, slowest total time first."""
+        with self._lock:
+            rows = [{"statement": key, **stats} for key, stats in self._stats.items()]
+        return sorted(rows, key=lambda s: s["total_time"], reverse=True)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def explain(conn, sql: str, params):
+    if not sql.lstrip().upper().startswith(
+        ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+    ):
+        return None
+    try:
+        return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())]
+    except sqlite3.Error:
+        return None
+
+
+# Set by enable(); read by ProfiledConnection and utils.connect
+active = None
+
+
+def enable(slow_threshold: float = 0.1) -> StatementProfiler:
+    global active
+    active = StatementProfiler(slow_threshold)
+    return active
+
+
+def disable():
+    global active
+    active = None
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        conn = self.connection
+        conn._steps = 0
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            conn._record(sql, parameters, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        conn = self.connection
+        conn._steps = 0
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            conn._record(sql, None, time.perf_counter() - start, self.rowcount)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """A `sqlite3.Connection` that reports every statement to the active profiler."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._steps = 0
+        self._explaining = False
+        self.set_progress_handler(self._progress, PROGRESS_STEPS)
+
+    def _progress(self):
+        self._steps += PROGRESS_STEPS
+        return 0
+
+    def _record(self, sql, params, seconds, rows):
+        profiler = active
+        if profiler is None or self._explaining:
+            return
+        self._explaining = True
+        try:
+            profiler.record(self, sql, params, seconds, rows, self.in_transaction, self._steps)
+        finally:
+            self._explaining = False
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def instrument_sqlalchemy(engine_or_class, profiler: StatementProfiler):
+    """Record every statement run through `engine_or_class` (e.g. `sqlalchemy.engine.Engine`)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine_or_class, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profiler_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine_or_class, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["profiler_start"].pop()
+        dbapi_connection = conn.connection.dbapi_connection
+        profiler.record(
+            dbapi_connection,
+            statement,
+            None if executemany else parameters,
+            seconds,
+            cursor.rowcount,
+            dbapi_connection.in_transaction,
+        )
@@ -0,0 +1,191 @@
+"""
+Snapshot read replicas, refreshed with the sqlite3 backup API.
+
+Read-heavy pages compete with writers for the SHARED lock; on a rollback-journal
+database, a writer's PENDING lock also blocks new readers (see pages 2 and 9).
+A `Replica` periodically copies the primary into memory (or into a separate
+file) with `Connection.backup()`, `pages_per_step` pages at a time, so the
+primary's SHARED lock is only held briefly per step. Queries run through
+`reader()` then go to the latest snapshot and never touch the primary's locks,
+unless the snapshot is older than `max_staleness` seconds, in which case they
+fall back to the primary.
+
+Writes to the primary during a backup make SQLite restart the copy, so under a
+constant write load larger steps finish sooner.
+
+Each reader thread gets its own connection to the snapshot, reopened when a new
+one is taken. In-memory snapshots are kept as `serialize()`d bytes, and
+deserialized into each thread's connection, so memory use is one copy per
+reading thread (plus one) rather than one in total.
+
+    python replica.py --check  # read through both kinds of replica, of WAL and non-WAL primaries
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+class Replica:
+    def __init__(
+        self,
+        primary,
+        path=None,
+        interval: float = 5.0,
+        max_staleness: float = 30.0,
+        pages_per_step: int = 256,
+        step_sleep: float = 0.001,
+    ):
+        self.primary = Path(primary).resolve()
+        self.path = path
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.refreshes = 0
+        self.fallback_reads = 0
+        self.last_refresh_duration = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # (data, taken_at, generation); data is None for file replicas
+        self._snapshot = (None, None, 0)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect_primary(self) -> sqlite3.Connection:
+        return utils.connect(
+            f"file:{self.primary}?mode=ro", uri=True, check_same_thread=False
+        )
+
+    def refresh(self):
+        """Take a new snapshot of the primary, and switch readers over to it."""
+        start = time.perf_counter()
+        taken_at = time.monotonic()
+        src = self._connect_primary()
+        try:
+            if self.path is None:
+                dst = sqlite3.connect(":memory:")
+                try:
+                    src.backup(dst, pages=self.pages_per_step, sleep=self.step_sleep)
+                    # The copy keeps a WAL primary's header, which deserialize() cannot open
+                    data = utils.deserializable(dst.serialize())
+                finally:
+                    dst.close()
+            else:
+                tmp = f"{self.path}.tmp"
+                dst = sqlite3.connect(tmp)
+                src.backup(dst, pages=self.pages_per_step, sleep=self.step_sleep)
+                dst.close()
+                # Readers with the previous file open keep reading it until they reconnect
+                os.replace(tmp, self.path)
+                data = None
+        finally:
+            src.close()
+
+        with self._lock:
+            generation = self._snapshot[2] + 1
+            # Readers pick up the new generation on their next reader()
+            self._snapshot = (data, taken_at, generation)
+        self.refreshes += 1
+        self.last_refresh_duration = time.perf_counter() - start
+
+    @property
+    def staleness(self) -> float:
+        taken_at = self._snapshot[1]
+        return float("inf") if taken_at is None else time.monotonic() - taken_at
+
+    @contextmanager
+    def reader(self):
+        """A connection to the latest snapshot, or to the primary if that is too stale."""
+        data, taken_at, generation = self._snapshot
+        if taken_at is None or time.monotonic() - taken_at > self.max_staleness:
+            self.fallback_reads += 1
+            primary = getattr(self._local, "primary", None)
+            if primary is None:
+                primary = self._local.primary = self._connect_primary()
+            yield primary
+            return
+
+        cached = getattr(self._local, "replica", None)
+        if cached is None or cached[1] != generation:
+            if cached is not None:
+                cached[0].close()
+            if self.path is None:
+                conn = sqlite3.connect(":memory:")
+                conn.deserialize(data)
+                conn.execute("PRAGMA query_only=ON")
+            else:
+                conn = sqlite3.connect(f"file:{Path(self.path).resolve()}?mode=ro", uri=True)
+            cached = self._local.replica = (conn, generation)
+        yield cached[0]
+
+    def start(self):
+        self.refresh()
+        self._thread = threading.Thread(
+            target=self._run, name="replica-refresh", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Replica refresh failed")
+
+
+def check():
+    """Read a fresh row through in-memory and file replicas, of WAL and non-WAL primaries."""
+    ok = True
+    with tempfile.TemporaryDirectory() as d:
+        for journal_mode in ("delete", "wal"):
+            primary = utils.init_db(d)
+            conn = sqlite3.connect(primary, isolation_level=None)
+            conn.execute(f"PRAGMA journal_mode={journal_mode}")
+            for path in (None, Path(d) / f"replica-{journal_mode}.db"):
+                conn.execute("INSERT INTO users (name) VALUES (?)", (str(path),))
+                replica = Replica(primary, path)
+                try:
+                    replica.refresh()
+                    with replica.reader() as reader:
+                        rows = reader.execute("SELECT name FROM users").fetchall()
+                    result = "ok" if (str(path),) in rows else f"FAILED, read {rows}"
+                except sqlite3.Error as e:
+                    result = f"FAILED: {e}"
+                ok = ok and result == "ok"
+                kind = "memory" if path is None else "file"
+                print(f"primary={journal_mode} replica={kind}: {result}")
+            conn.close()
+    if not ok:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+    if args.check:
+        check()
+
+
+if __name__ == "__main__":
+    main()
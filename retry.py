@@ -0,0 +1,202 @@
+"""
+Whole-transaction retries for lock errors.
+
+SQLite does not call the busy handler when it detects a possible deadlock (see
+pages/2_2_Threads,_Different_Connections.py), or for table-level locks in shared
+cache mode (see pages/7_Misc:_Shared_Cache.py), so `timeout=` alone does not
+help there. Retrying just the failed statement does not help either: the
+transaction still holds its SHARED lock. The only fix is to roll back and re-run
+the whole transaction, which is what this module does.
+
+As a decorator, for functions taking the connection as their first argument:
+
+    @retry_transaction()
+    def transfer(conn, ...):
+        conn.execute(...)
+
+Or as a loop of context managers, each attempt committing on success:
+
+    for attempt in RetryPolicy().attempts(conn):
+        with attempt:
+            conn.execute(...)
+"""
+
+import functools
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# Error kinds
+LOCKED = "locked"  # SQLITE_BUSY after the busy handler gave up
+TABLE_LOCKED = "table_locked"  # SQLITE_LOCKED, e.g. shared cache table locks
+DEADLOCK = "deadlock"  # SQLITE_BUSY returned without waiting out the busy timeout
+
+
+class RetryMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = Counter()
+        self.gave_up = Counter()
+        self.succeeded_after_retry = 0
+
+    def record_retry(self, kind: str):
+        with self._lock:
+            self.retries[kind] += 1
+
+    def record_gave_up(self, kind: str):
+        with self._lock:
+            self.gave_up[kind] += 1
+
+    def record_success(self, attempt: int):
+        if attempt > 1:
+            with self._lock:
+                self.succeeded_after_retry += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "retries": dict(self.retries),
+                "gave_up": dict(self.gave_up),
+                "succeeded_after_retry": self.succeeded_after_retry,
+            }
+
+
+metrics = RetryMetrics()
+
+
+def classify(e: BaseException, elapsed: float, busy_timeout: float):
+    """The kind of lock error `e` is, or None if retrying would not help."""
+    if not isinstance(e, sqlite3.OperationalError):
+        return None
+    code = getattr(e, "sqlite_errorcode", None)
+    if code is None:
+        # Python < 3.11: fall back to the message
+        message = str(e)
+        if "database table is locked" in message:
+            code = sqlite3.SQLITE_LOCKED
+        elif "database is locked" in message:
+            code = sqlite3.SQLITE_BUSY
+    if code is None:
+        return None
+    if code & 0xFF == sqlite3.SQLITE_LOCKED:
+        return TABLE_LOCKED
+    if code & 0xFF == sqlite3.SQLITE_BUSY:
+        # SQLITE_BUSY_SNAPSHOT (WAL), or a BUSY well before the busy timeout expired
+        if code != sqlite3.SQLITE_BUSY or elapsed < busy_timeout * 0.9:
+            return DEADLOCK
+        return LOCKED
+    return None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, per error kind.
+
+    `max_attempts` maps each kind to its total number of attempts. A plain
+    `LOCKED` error has already waited out the busy timeout, so it gets fewer
+    attempts by default. `budget` caps the total time across all attempts.
+    `busy_timeout` should match the connection's `timeout=`.
+    """
+
+    def __init__(
+        self,
+        max_attempts=None,
+        base_delay: float = 0.005,
+        max_delay: float = 0.5,
+        budget: float = 10.0,
+        busy_timeout: float = 5.0,
+        metrics: RetryMetrics = metrics,
+    ):
+        self.max_attempts = {
+            LOCKED: 2,
+            TABLE_LOCKED: 10,
+            DEADLOCK: 10,
+            **(max_attempts or {}),
+        }
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.busy_timeout = busy_timeout
+        self.metrics = metrics
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def attempts(self, conn: sqlite3.Connection):
+        """Yield `Attempt`s until one succeeds, or raise once retries are exhausted."""
+        deadline = time.monotonic() + self.budget
+        attempt = 1
+        while True:
+            current = Attempt(self, conn, attempt, deadline)
+            yield current
+            if current.succeeded:
+                return
+            attempt += 1
+
+
+class Attempt:
+    def __init__(
+        self, policy: RetryPolicy, conn: sqlite3.Connection, number: int, deadline: float
+    ):
+        self.policy = policy
+        self.conn = conn
+        self.number = number
+        self.deadline = deadline
+        self.succeeded = False
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        from_commit = False
+        if exc is None:
+            try:
+                self.conn.commit()
+            except sqlite3.OperationalError as e:
+                exc, from_commit = e, True
+            else:
+                self.succeeded = True
+                self.policy.metrics.record_success(self.number)
+                return False
+
+        if self.conn.in_transaction:
+            self.conn.rollback()
+
+        policy = self.policy
+        kind = classify(exc, time.monotonic() - self.started, policy.busy_timeout)
+        delay = policy.delay(self.number)
+        if kind is not None and (
+            self.number >= policy.max_attempts[kind] or time.monotonic() + delay > self.deadline
+        ):
+            policy.metrics.record_gave_up(kind)
+            kind = None
+        if kind is None:
+            if from_commit:
+                raise exc
+            return False
+
+        policy.metrics.record_retry(kind)
+        time.sleep(delay)
+        # Suppress the error; the caller's loop starts the next attempt
+        return True
+
+
+def retry_transaction(policy: RetryPolicy = None):
+    """Decorator form, for functions whose first argument is the connection."""
+    policy = policy or RetryPolicy()
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(conn, *args, **kwargs):
+            for attempt in policy.attempts(conn):
+                with attempt:
+                    result = fn(conn, *args, **kwargs)
+                if attempt.succeeded:
+                    return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,162 @@
+"""
+Lock scenarios from the pages, as plain functions returning their observations.
+
+The page 2 scenario (recorded again on page 10) deliberately sleeps and waits
+out a 5s busy timeout, which would otherwise tie up a Streamlit worker thread
+for 6-11s per visitor. Pages show `cached()` results, computed once per
+SQLite/Python version, and only run a scenario live on request, through
+`run_live()`, which never runs more than `MAX_LIVE_RUNS` at once.
+"""
+
+import platform
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import lock_timeline
+from utils import init_db
+
+MAX_LIVE_RUNS = 2
+
+_live_runs = ThreadPoolExecutor(MAX_LIVE_RUNS, thread_name_prefix="live-scenario")
+_live_slots = threading.BoundedSemaphore(MAX_LIVE_RUNS)
+
+
+def _connect(db, name: str) -> sqlite3.Connection:
+    return sqlite3.connect(db, check_same_thread=False)
+
+
+def two_threads_different_connections(connect=_connect) -> dict:
+    """
+    Two threads on different connections each read in a DEFERRED transaction,
+    then try to write (pages/2_2_Threads,_Different_Connections.py).
+    Connections are opened with `connect(db, name)`.
+    """
+    with tempfile.TemporaryDirectory() as d:
+        db = init_db(d)
+        conn = connect(db, "conn")
+        conn1 = connect(db, "conn1")
+        conn2 = connect(db, "conn2")
+        start = time.monotonic()
+        exceptions = []
+
+        def attempt_read_then_write(thread_conn: sqlite3.Connection, thread_num: int):
+            thread_conn.execute("BEGIN")
+            thread_conn.execute("SELECT * FROM USERS;")
+            time.sleep(1)
+            if thread_num == 2:
+                time.sleep(0.1)
+            statement = "INSERT"
+            try:
+                thread_conn.execute(
+                    """INSERT INTO users (name) VALUES (?);""",
+                    (f"From Thread {thread_num}",),
+                )
+                statement = "commit()"
+                thread_conn.commit()
+            except Exception as e:
+                exceptions.append(
+                    {
+                        "thread": thread_num,
+                        "statement": statement,
+                        "after": round(time.monotonic() - start, 2),
+                        "error": str(e),
+                    }
+                )
+
+        thread1 = threading.Thread(target=attempt_read_then_write, args=[conn1, 1])
+        thread2 = threading.Thread(target=attempt_read_then_write, args=[conn2, 2])
+        thread1.start()
+        thread2.start()
+        thread1.join()
+        thread2.join()
+
+        result = {
+            "exceptions": exceptions,
+            "conn1_rows": conn1.execute("SELECT * FROM users;").fetchall(),
+            "conn2_rows": conn2.execute("SELECT * FROM users;").fetchall(),
+            "thread1_alive": thread1.is_alive(),
+            "thread2_alive": thread2.is_alive(),
+        }
+        try:
+            result["conn_read"] = conn.execute("SELECT * FROM users;").fetchall()
+        except Exception as e:
+            result["conn_read"] = str(e)
+
+        conn2.commit()
+        conn1.commit()
+        result["rows_after_commit"] = conn.execute("SELECT * FROM users;").fetchall()
+        for c in (conn, conn1, conn2):
+            c.close()
+    return result
+
+
+def two_threads_different_connections_timeline() -> dict:
+    """
+    `two_threads_different_connections`, with its connections' lock events
+    recorded (see `lock_timeline`), for pages/10_Lock_Timeline.py.
+    """
+    recorder = lock_timeline.TimelineRecorder()
+
+    def connect(db, name):
+        conn = sqlite3.connect(
+            db, check_same_thread=False, factory=lock_timeline.TimelineConnection
+        )
+        conn.name = name
+        return recorder.watch(conn)
+
+    two_threads_different_connections(connect)
+    return {"events": recorder.snapshot()}
+
+
+SCENARIOS = {
+    "two_threads_different_connections": two_threads_different_connections,
+    "two_threads_different_connections_timeline": two_threads_different_connections_timeline,
+}
+
+
+def versions() -> dict:
+    return {"sqlite": sqlite3.sqlite_version, "python": platform.python_version()}
+
+
+def _run_cached(name: str, sqlite_version: str, python_version: str) -> dict:
+    # The versions are only there to key the cache
+    return {**SCENARIOS[name](), "versions": versions(), "ran_at": time.ctime()}
+
+
+_cached = None
+
+
+def cached(name: str) -> dict:
+    """The result of scenario `name`, run once per SQLite/Python version."""
+    global _cached
+    if _cached is None:
+        import streamlit as st
+
+        _cached = st.cache_data(persist="disk", show_spinner="Running scenario...")(_run_cached)
+    v = versions()
+    return _cached(name, v["sqlite"], v["python"])
+
+
+def run_live(name: str, timeout: float = 30.0):
+    """
+    Run scenario `name` now, or return None if `MAX_LIVE_RUNS` are already
+    running, or if it does not finish within `timeout` seconds (it keeps its
+    slot until it does).
+    """
+    if not _live_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _live_runs.submit(SCENARIOS[name])
+    except BaseException:
+        _live_slots.release()
+        raise
+    future.add_done_callback(lambda _: _live_slots.release())
+    try:
+        result = future.result(timeout)
+    except FutureTimeout:
+        return None
+    return {**result, "versions": versions(), "ran_at": time.ctime()}
@@ -0,0 +1,182 @@
+"""
+Hash-sharded tables, spread over several SQLite files.
+
+SQLite allows one writer per database file. The app splits its tables between
+`db_1.py` and `db_2.py` (see pages/1_The_App.py), but any one table still has a
+single writer. `ShardedTable` hash-partitions one table by key over `shards`
+files instead, each with its own `utils.Writer` thread and
+`utils.ConnectionPool` of readers, so writes to different shards run in
+parallel:
+
+- point reads and writes (`fetch`, `execute`, `submit`) go straight to the
+  shard that owns the key
+- `scatter` runs a query on every shard in parallel, and `gather` merges the
+  results
+
+sqlite3 releases the GIL while SQLite runs a statement, so shards scale across
+cores as long as the per-row Python work stays small.
+
+Rows keep the ids their shard gives them; `global_id` makes them unique across
+shards.
+
+    python sharding.py --shards 1 2 4 8 --seconds 5
+"""
+
+import argparse
+import hashlib
+import heapq
+import itertools
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import utils
+
+
+def shard_of(key, shards: int) -> int:
+    """The shard owning `key`. Stable across processes, unlike `hash()`."""
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+class ShardedTable:
+    """
+    A table partitioned by key over `shards` database files in `dir`, each
+    created from `schema` (see `utils.template_db`) if it does not exist yet.
+    """
+
+    def __init__(
+        self,
+        dir,
+        table: str,
+        schema: str,
+        shards: int = 4,
+        readers: int = 2,
+        storage_profile: str = None,
+    ):
+        self.table = table
+        self.shards = shards
+        self.paths = [Path(dir) / f"{table}_{i}.db" for i in range(shards)]
+        template = None
+        for path in self.paths:
+            if not path.exists():
+                template = template or utils.template_db(schema, storage_profile=storage_profile)
+                utils.clone_db(template, dir).rename(path)
+        self.writers = [utils.Writer(path, storage_profile=storage_profile) for path in self.paths]
+        self.pools = [
+            utils.ConnectionPool(path, readers=readers, storage_profile=storage_profile)
+            for path in self.paths
+        ]
+        self._fan_out = ThreadPoolExecutor(shards, thread_name_prefix=f"{table}-scatter")
+
+    def shard_of(self, key) -> int:
+        return shard_of(key, self.shards)
+
+    def global_id(self, shard: int, id: int) -> int:
+        """A row id unique across all shards, from its shard and id within the shard."""
+        return id * self.shards + shard
+
+    def split_id(self, global_id: int):
+        """The (shard, id) a `global_id` was made from."""
+        id, shard = divmod(global_id, self.shards)
+        return shard, id
+
+    def writer(self, key) -> utils.Writer:
+        return self.writers[self.shard_of(key)]
+
+    def submit(self, key, fn, *args):
+        """Run `fn(conn, *args)` in a write transaction on `key`'s shard. Returns a future."""
+        return self.writer(key).submit(fn, *args)
+
+    def execute(self, key, sql: str, params=()):
+        """Queue a write on `key`'s shard. The future resolves to its `fetchall()` rows."""
+        return self.writer(key).execute(sql, params)
+
+    def fetch(self, key, sql: str, params=()) -> list:
+        """Run a read on `key`'s shard."""
+        with self.pools[self.shard_of(key)].reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _fetch_shard(self, shard: int, sql: str, params) -> list:
+        with self.pools[shard].reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def scatter(self, sql: str, params=()) -> list:
+        """Run a read on every shard in parallel. Returns each shard's rows, in shard order."""
+        futures = [
+            self._fan_out.submit(self._fetch_shard, shard, sql, params)
+            for shard in range(self.shards)
+        ]
+        return [future.result() for future in futures]
+
+    def gather(
+        self, sql: str, params=(), order_by=None, reverse: bool = False, limit: int = None
+    ) -> list:
+        """
+        `scatter`, merged into a single list of rows. If `order_by` (a function of
+        a row) is given, each shard's rows must already be sorted by it, e.g. by
+        the query's ORDER BY, and they are merged in order.
+        """
+        results = self.scatter(sql, params)
+        if order_by is None:
+            rows = itertools.chain.from_iterable(results)
+        else:
+            rows = heapq.merge(*results, key=order_by, reverse=reverse)
+        return list(itertools.islice(rows, limit))
+
+    def close(self):
+        self._fan_out.shutdown()
+        for writer in self.writers:
+            writer.close()
+        for pool in self.pools:
+            pool.close()
+
+
+def create_user_if_not_exists(users: ShardedTable, email: str) -> int:
+    """`utils.create_user_if_not_exists` on `email`'s shard, returning a global id."""
+    shard = users.shard_of(email)
+    return users.global_id(shard, utils.create_user_if_not_exists(users.writers[shard], email))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads", type=int, default=32, help="concurrent upserting threads")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--storage-profile", choices=list(utils.STORAGE_PROFILES))
+    args = parser.parse_args()
+
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as d:
+            users = ShardedTable(
+                d,
+                "users",
+                utils.APP_USERS_SCHEMA,
+                shards=shards,
+                storage_profile=args.storage_profile,
+            )
+            stop = time.monotonic() + args.seconds
+            counts = [0] * args.threads
+
+            def upsert(i):
+                while time.monotonic() < stop:
+                    create_user_if_not_exists(users, f"{uuid.uuid4()}@example.com")
+                    counts[i] += 1
+
+            threads = [threading.Thread(target=upsert, args=(i,)) for i in range(args.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            total = sum(row[0] for row in users.gather("SELECT count(*) FROM users"))
+            users.close()
+        print(f"{shards} shard(s): {sum(counts) / args.seconds:,.0f} upserts/s ({total:,} rows)")
+
+
+if __name__ == "__main__":
+    main()
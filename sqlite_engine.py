@@ -0,0 +1,210 @@
+"""
+SQLAlchemy engines shaped like SQLite: one writer, many readers.
+
+A generic `QueuePool` hands every session any connection, so writers queue
+twice: once for a pooled connection (QueuePool timeouts when there are more
+threads than connections), and again inside SQLite for the write lock
+(`database is locked` when there are fewer). See the findings in
+`sqlalchemy_stress_test.py`.
+
+`create_engines()` instead returns two engines for a WAL-mode database:
+
+- a writer engine over exactly one connection, which starts its transactions
+  with `BEGIN IMMEDIATE` and is handed out in request order (`WriterPool`), so
+  writers wait in one fair, bounded queue instead of in SQLite's busy handler
+- a reader engine over a pool of read-only connections
+
+`RoutingSession` sends each statement to one or the other, and keeps a session
+on the writer once it has written. `SQLiteConnection` wires both into
+`st.connection`:
+
+    conn = st.connection("sqlite", type=SQLiteConnection, url="sqlite:///app.db")
+    with conn.session as s:
+        s.execute(text("INSERT INTO users (name) VALUES (:name)"), {"name": name})
+        s.commit()
+"""
+
+import re
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.sql.elements import TextClause
+from streamlit.connections import SQLConnection
+
+import utils
+from admission import AdmissionController, AdmissionTimeout
+
+# Text statements that are known not to write; anything else goes to the writer
+READ_ONLY = re.compile(r"\s*(SELECT|EXPLAIN)\b", re.IGNORECASE)
+
+
+class WriterPool(StaticPool):
+    """
+    A single connection, checked out by one thread at a time in FIFO order,
+    through an `admission.AdmissionController`. Checkouts wait up to `timeout`
+    seconds (forever if None), and raise `admission.Overloaded` straight away
+    when `max_queue` are already waiting.
+    """
+
+    def __init__(self, creator, timeout: float = None, max_queue: int = 64, **kwargs):
+        super().__init__(creator, **kwargs)
+        self._timeout = timeout
+        self._max_queue = max_queue
+        self.admission = AdmissionController(1, max_queue, timeout)
+
+    def status(self) -> str:
+        return f"WriterPool {self.admission.snapshot()}"
+
+    def recreate(self) -> "WriterPool":
+        self.logger.info("Pool recreating")
+        return self.__class__(
+            creator=self._creator,
+            timeout=self._timeout,
+            max_queue=self._max_queue,
+            recycle=self._recycle,
+            reset_on_return=self._reset_on_return,
+            pre_ping=self._pre_ping,
+            echo=self.echo,
+            logging_name=self._orig_logging_name,
+            _dispatch=self.dispatch,
+            dialect=self._dialect,
+        )
+
+    def _do_get(self):
+        try:
+            token = self.admission.acquire()
+        except AdmissionTimeout as e:
+            raise TimeoutError(str(e)) from e
+        try:
+            record = super()._do_get()
+        except BaseException:
+            self.admission.release(token)
+            raise
+        # One connection, so one holder: SQLAlchemy may return it on another thread
+        self._token = token
+        return record
+
+    def _do_return_conn(self, record):
+        self.admission.release(self._token)
+
+
+def create_engines(
+    database,
+    readers: int = 4,
+    write_timeout: float = None,
+    max_write_queue: int = 64,
+    read_timeout: float = 30.0,
+    storage_profile: str = None,
+    busy_timeout: float = 5.0,
+):
+    """
+    `(writer, reader)` engines for the database at `database`, which is put in
+    WAL mode. Connections are opened with `utils.connect`, so they are profiled
+    and watched like any other.
+    """
+    database = Path(database).resolve()
+
+    def connect_writer():
+        conn = utils.connect(
+            database,
+            storage_profile,
+            isolation_level=None,
+            timeout=busy_timeout,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def connect_reader():
+        conn = utils.connect(
+            f"file:{database}?mode=ro",
+            storage_profile,
+            uri=True,
+            timeout=busy_timeout,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    # Open the writer first, so the database is in WAL mode before any reader connects
+    writer = create_engine(
+        "sqlite://",
+        pool=WriterPool(connect_writer, timeout=write_timeout, max_queue=max_write_queue),
+    )
+    writer.connect().close()
+
+    @event.listens_for(writer, "begin")
+    def begin_immediate(conn):
+        # Take the write lock up front: a DEFERRED transaction that reads
+        # first can deadlock on its first write (see pages/2)
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    reader = create_engine(
+        "sqlite://",
+        pool=QueuePool(
+            connect_reader, pool_size=readers, max_overflow=0, timeout=read_timeout
+        ),
+    )
+    return writer, reader
+
+
+def writes(clause) -> bool:
+    """Whether `clause` may write, erring on the side of yes."""
+    if clause is None:
+        return False
+    if getattr(clause, "is_dml", False) or getattr(clause, "is_ddl", False):
+        return True
+    if isinstance(clause, TextClause):
+        return not READ_ONLY.match(clause.text)
+    return False
+
+
+class RoutingSession(Session):
+    """
+    A session that reads from `reader` and writes through `writer`. Once it
+    has written, the rest of its transaction stays on the writer, so that it
+    reads its own writes.
+    """
+
+    def __init__(self, writer, reader, **kwargs):
+        super().__init__(**kwargs)
+        self.writer = writer
+        self.reader = reader
+        self._writing = False
+        event.listen(self, "after_transaction_end", self._transaction_ended)
+
+    def _transaction_ended(self, session, transaction):
+        if transaction.parent is None:
+            self._writing = False
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if self._writing or self._flushing or writes(clause):
+            self._writing = True
+            return self.writer
+        return self.reader
+
+
+class SQLiteConnection(SQLConnection):
+    """
+    `st.connection` type for SQLite, backed by `create_engines()`. Takes `url`
+    (as for `SQLConnection`), plus `create_engines()`'s keyword arguments.
+    `engine` and `query()` use the reader engine; `session` is a
+    `RoutingSession`.
+    """
+
+    def _connect(self, **kwargs):
+        url = kwargs.pop("url", None) or self._secrets["url"]
+        self._writer, reader = create_engines(make_url(url).database, **kwargs)
+        return reader
+
+    @property
+    def writer(self):
+        return self._writer
+
+    @property
+    def session(self) -> RoutingSession:
+        return RoutingSession(self._writer, self._instance)
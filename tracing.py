@@ -0,0 +1,30 @@
+"""
+Shared sqlite3 trace callbacks.
+
+A connection has a single trace callback, but several tools want one (the
+transaction watchdog and the lock timeline). `add_trace_callback` chains them.
+Connections must be weakly referenceable, i.e. opened with a
+`sqlite3.Connection` subclass as their factory.
+"""
+
+import sqlite3
+import threading
+import weakref
+
+_callbacks = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def add_trace_callback(conn: sqlite3.Connection, callback):
+    """Call `callback(sql)` for every statement `conn` runs, after any already added."""
+    with _lock:
+        callbacks = _callbacks.get(conn)
+        if callbacks is None:
+            callbacks = _callbacks[conn] = []
+
+            def trace(sql: str):
+                for callback in callbacks:
+                    callback(sql)
+
+            conn.set_trace_callback(trace)
+        callbacks.append(callback)
@@ -0,0 +1,165 @@
+"""
+Background watchdog for leaked transactions.
+
+A transaction left open (e.g. an exception between an `INSERT` and `commit()`, see
+pages/3_2_Threads,_Same_Connection.py) keeps its lock until the connection is
+closed. The watchdog tracks connections opened through `utils.connect` once
+`start()` has been called, and any connection passed to `watch()`. Transactions
+open for longer than `deadline` seconds are logged, along with the stack that
+began them, and then interrupted and rolled back.
+
+Rolling back from the watchdog thread requires the connection to have been
+opened with `check_same_thread=False`; otherwise the transaction can only be
+interrupted, and the error is logged.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import traceback
+import weakref
+
+from tracing import add_trace_callback
+
+logger = logging.getLogger(__name__)
+
+
+class WatchedConnection(sqlite3.Connection):
+    """Plain `sqlite3.Connection` subclass, as the base class cannot be weakly referenced."""
+
+
+class _Transaction:
+    __slots__ = ("began_at", "stack", "thread", "reported")
+
+    def __init__(self):
+        self.began_at = None
+        self.stack = None
+        self.thread = None
+        # Set once a rollback has failed, so each stuck transaction is only logged once
+        self.reported = False
+
+
+class TransactionWatchdog:
+    def __init__(
+        self,
+        deadline: float = 5.0,
+        interval: float = 0.5,
+        capture_stacks: bool = True,
+    ):
+        self.deadline = deadline
+        self.interval = interval
+        self.capture_stacks = capture_stacks
+        self.rollbacks = 0
+        self._connections = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, conn: sqlite3.Connection) -> sqlite3.Connection:
+        """
+        Track `conn`. Adds a trace callback (see `tracing`) to note when, and
+        from where, each transaction begins.
+        """
+        txn = _Transaction()
+        conn_ref = weakref.ref(conn)
+        capture_stacks = self.capture_stacks
+
+        def trace(sql: str):
+            conn = conn_ref()
+            if conn is None or conn.in_transaction:
+                return
+            if sql.lstrip()[:9].upper().startswith(("BEGIN", "SAVEPOINT")):
+                txn.began_at = time.monotonic()
+                txn.reported = False
+                txn.thread = threading.current_thread().name
+                # Skip this frame
+                txn.stack = "".join(traceback.format_stack()[:-1]) if capture_stacks else None
+
+        add_trace_callback(conn, trace)
+        with self._lock:
+            self._connections[conn] = txn
+        return conn
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="transaction-watchdog", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def check(self):
+        """Roll back every transaction older than the deadline. Called every `interval`."""
+        now = time.monotonic()
+        with self._lock:
+            connections = list(self._connections.items())
+        for conn, txn in connections:
+            try:
+                in_transaction = conn.in_transaction
+            except sqlite3.ProgrammingError:
+                # Closed
+                with self._lock:
+                    self._connections.pop(conn, None)
+                continue
+            if not in_transaction:
+                txn.began_at = None
+                txn.reported = False
+                continue
+            if txn.began_at is None:
+                # Began without passing through the trace callback
+                txn.began_at = now
+                continue
+            age = now - txn.began_at
+            if age > self.deadline and not txn.reported:
+                self._end(conn, txn, age)
+
+    def _end(self, conn: sqlite3.Connection, txn: _Transaction, age: float):
+        logger.warning(
+            "Transaction open for %.1fs (deadline %.1fs) on connection %#x, "
+            "begun by thread %s at:\n%s",
+            age,
+            self.deadline,
+            id(conn),
+            txn.thread,
+            txn.stack or "(stack not captured)",
+        )
+        conn.interrupt()
+        try:
+            conn.rollback()
+        except sqlite3.Error as e:
+            logger.error("Could not roll back connection %#x: %s", id(conn), e)
+            txn.reported = True
+            return
+        txn.began_at = None
+        self.rollbacks += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Transaction watchdog check failed")
+
+
+# Set by start(); read by utils.connect
+active = None
+
+
+def start(
+    deadline: float = 5.0, interval: float = 0.5, capture_stacks: bool = True
+) -> TransactionWatchdog:
+    global active
+    active = TransactionWatchdog(deadline, interval, capture_stacks).start()
+    return active
+
+
+def stop():
+    global active
+    if active is not None:
+        active.stop()
+    active = None
@@ -1,16 +1,835 @@
+import csv
+import hashlib
+import heapq
+import inspect
+import itertools
+import json
+import math
+import os
+import queue
+import shutil
 import sqlite3
+import tempfile
+import threading
+import time
 import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 
+import lock_timeline
+import profiler
+import transaction_watchdog
 
-def init_db(dir: str):
+
+# Named storage tuning profiles. page_size and journal_mode are persistent and
+# applied when the database is created; the rest are per connection.
+STORAGE_PROFILES = {
+    "durable": {
+        "page_size": 4096,
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16_000,  # KiB
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "wal_autocheckpoint": 1000,
+    },
+    "throughput": {
+        "page_size": 4096,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64_000,
+        "mmap_size": 256 * 2**20,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 4000,
+    },
+    "read-heavy": {
+        "page_size": 8192,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -256_000,
+        "mmap_size": 2**30,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000,
+    },
+}
+CREATE_PRAGMAS = ("page_size", "journal_mode")
+
+
+def apply_storage_profile(conn: sqlite3.Connection, storage_profile: str, on_create=False):
+    """
+    Set `storage_profile`'s per-connection PRAGMAs on `conn`, and with `on_create`
+    its persistent ones too. Changing the page_size of an existing database
+    runs a `VACUUM`, which is not possible once it is in WAL mode.
+    """
+    for pragma, value in STORAGE_PROFILES[storage_profile].items():
+        if on_create or pragma not in CREATE_PRAGMAS:
+            conn.execute(f"PRAGMA {pragma}={value}")
+        if on_create and pragma == "page_size":
+            if conn.execute("PRAGMA page_size").fetchone()[0] != value:
+                conn.execute("VACUUM")
+
+
+def connect(database, storage_profile: str = None, **kwargs) -> sqlite3.Connection:
+    """
+    `sqlite3.connect`, with `storage_profile`'s per-connection PRAGMAs applied.
+
+    Instrumented when profiling is enabled (see `profiler.enable`), tracked by
+    the leaked-transaction watchdog when it is running (see
+    `transaction_watchdog.start`), and recorded on the lock timeline when that
+    is (see `lock_timeline.start`).
+    """
+    watchdog = transaction_watchdog.active
+    timeline = lock_timeline.active
+    if profiler.active is not None:
+        kwargs.setdefault("factory", profiler.ProfiledConnection)
+    elif timeline is not None:
+        kwargs.setdefault("factory", lock_timeline.TimelineConnection)
+    elif watchdog is not None:
+        kwargs.setdefault("factory", transaction_watchdog.WatchedConnection)
+    conn = sqlite3.connect(database, **kwargs)
+    if storage_profile is not None:
+        apply_storage_profile(conn, storage_profile)
+    if watchdog is not None:
+        watchdog.watch(conn)
+    if timeline is not None:
+        timeline.watch(conn)
+    return conn
+
+
+USERS_SCHEMA = "CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT);"
+# The app's users table (see pages/1_The_App.py), for `create_user_if_not_exists`
+# and `UserIdCache`
+APP_USERS_SCHEMA = "CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT UNIQUE);"
+
+TEMPLATE_DIR = Path(tempfile.gettempdir()) / "sqlite3-deadlock-templates"
+_template_bytes = {}
+
+
+def template_db(definition, key: str = None, storage_profile: str = None) -> Path:
+    """
+    A template database built from `definition` (an SQL script, or a callable
+    taking the path of the database to build), built on first use and then reused.
+
+    Templates are keyed by `key` (by default the SQL or the callable's source),
+    the storage profile and the SQLite version, so changing any of them builds a
+    new one. Use `clone_db`/`clone_memory` to get a copy to work on.
+    """
+    if key is None:
+        key = definition if isinstance(definition, str) else inspect.getsource(definition)
+    digest = hashlib.sha256(
+        f"{sqlite3.sqlite_version}\n{storage_profile}\n{key}".encode()
+    ).hexdigest()[:16]
+    path = TEMPLATE_DIR / f"{digest}.db"
+    if path.exists():
+        return path
+
+    TEMPLATE_DIR.mkdir(exist_ok=True)
+    # Build under a unique name and rename, so concurrent builders never see a partial template
+    tmp = path.with_suffix(f".{uuid.uuid4()}.tmp")
+    conn = sqlite3.connect(tmp)
+    try:
+        if storage_profile is not None:
+            apply_storage_profile(conn, storage_profile, on_create=True)
+        if isinstance(definition, str):
+            conn.executescript(definition)
+            conn.commit()
+    finally:
+        # Closing the last connection checkpoints and removes any WAL
+        conn.close()
+    if not isinstance(definition, str):
+        definition(tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def clone_db(template: Path, dir) -> Path:
+    """A new database file in `dir`, copied from `template`."""
     db_path = Path(dir) / str(uuid.uuid4())
-    conn = sqlite3.connect(db_path)
-    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT);")
-    conn.commit()
+    shutil.copyfile(template, db_path)
     return db_path
 
 
+def deserializable(data: bytes) -> bytes:
+    """
+    The database image `data`, ready for `Connection.deserialize()`. An in-memory
+    database has no -wal or -shm file, so an image of a WAL-mode database
+    (header bytes 18 and 19 set to 2) fails with "unable to open database file"
+    on first use; it is switched to rollback journal mode instead.
+    """
+    if data[18:20] != b"\x02\x02":
+        return data
+    data = bytearray(data)
+    data[18:20] = b"\x01\x01"
+    return bytes(data)
+
+
+def clone_memory(template: Path, **kwargs) -> sqlite3.Connection:
+    """A new in-memory database, deserialized from `template`."""
+    conn = sqlite3.connect(":memory:", **kwargs)
+    data = _template_bytes.get(template)
+    if data is None:
+        data = _template_bytes[template] = deserializable(Path(template).read_bytes())
+    conn.deserialize(data)
+    return conn
+
+
+def init_db(dir: str, storage_profile: str = None):
+    return clone_db(template_db(USERS_SCHEMA, storage_profile=storage_profile), dir)
+
+
+class TransactionTimeout(sqlite3.OperationalError):
+    """A scoped transaction ran past its `max_duration`, and was rolled back."""
+
+
+class _Deadlines:
+    """One thread calling `conn.interrupt()` for every transaction past its deadline."""
+
+    def __init__(self):
+        self._heap = []
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def add(self, deadline: float, transaction: dict):
+        with self._changed:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="transaction-deadlines", daemon=True
+                )
+                self._thread.start()
+            entry = transaction["entry"] = (deadline, id(transaction), transaction)
+            heapq.heappush(self._heap, entry)
+            # The thread only needs waking if it is now waiting for too long
+            if self._heap[0] is entry:
+                self._changed.notify()
+
+    def _run(self):
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, transaction = heapq.heappop(self._heap)
+                    transaction["interrupted"] = True
+                    transaction["conn"].interrupt()
+                self._changed.wait(self._heap[0][0] - now if self._heap else None)
+
+    def done(self, transaction: dict):
+        # Under the lock, so the transaction cannot be interrupted once it has ended
+        with self._changed:
+            # Drop it (and its connection) now rather than at its deadline
+            try:
+                self._heap.remove(transaction.pop("entry"))
+            except ValueError:
+                # Already interrupted
+                return
+            heapq.heapify(self._heap)
+
+
+_deadlines = _Deadlines()
+
+
+@contextmanager
+def _scoped_transaction(conn: sqlite3.Connection, begin: str, max_duration: float):
+    conn.execute(begin)
+    start = time.monotonic()
+    transaction = {"conn": conn, "interrupted": False}
+    _deadlines.add(start + max_duration, transaction)
+    try:
+        try:
+            yield conn
+            if time.monotonic() - start > max_duration:
+                raise TransactionTimeout(f"Transaction ran past its {max_duration}s budget")
+            conn.execute("COMMIT")
+        finally:
+            _deadlines.done(transaction)
+    except BaseException as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        if transaction["interrupted"] and not isinstance(e, TransactionTimeout):
+            raise TransactionTimeout(
+                f"Transaction interrupted after its {max_duration}s budget"
+            ) from e
+        raise
+
+
+def write_transaction(conn: sqlite3.Connection, max_duration: float = 5.0):
+    """
+    A write transaction on `conn`, committed on success and rolled back on error.
+
+    Starts with `BEGIN IMMEDIATE`, so the RESERVED lock is taken (or waited for,
+    up to the connection's `timeout`) up front, instead of by the first write of
+    a DEFERRED transaction, which can deadlock (see pages/2). Once the lock is
+    held, the transaction gets `max_duration` seconds: a statement still running
+    then is interrupted, and either way the transaction is rolled back and
+    `TransactionTimeout` raised, so the lock is never held much longer.
+    """
+    return _scoped_transaction(conn, "BEGIN IMMEDIATE", max_duration)
+
+
+@contextmanager
+def read_transaction(conn: sqlite3.Connection, max_duration: float = 1.0):
+    """
+    A DEFERRED, read-only transaction on `conn`, with the same time budget as
+    `write_transaction`. Writes fail, rather than upgrading the SHARED lock.
+    """
+    (query_only,) = conn.execute("PRAGMA query_only").fetchone()
+    conn.execute("PRAGMA query_only=ON")
+    try:
+        with _scoped_transaction(conn, "BEGIN DEFERRED", max_duration):
+            yield conn
+    finally:
+        # Connections opened read-only (such as replicas and pool readers) stay that way
+        conn.execute(f"PRAGMA query_only={query_only}")
+
+
+# Only safe while nothing else is using the database: a crash mid-load can leave it unusable
+def percentile(sorted_values, p):
+    """The nearest-rank `p`th percentile of `sorted_values`, rounded to 3 places."""
+    if not sorted_values:
+        return None
+    i = min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return round(sorted_values[i], 3)
+
+
+LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "cache_size": "-262144",  # 256 MiB
+    "temp_store": "MEMORY",
+}
+
+
+@dataclass
+class LoadStats:
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else float("inf")
+
+
+def bulk_load(
+    db_path,
+    table: str,
+    columns,
+    rows,
+    indexes=(),
+    chunk_size: int = 50_000,
+) -> LoadStats:
+    """
+    Stream `rows` (any iterable of tuples) into `table` with chunked `executemany`,
+    one transaction per chunk, then run the `indexes` DDL statements.
+
+    Building secondary indexes (e.g. `CREATE UNIQUE INDEX ... ON users(name)`) once
+    after the load is much cheaper than maintaining them row by row.
+    """
+    start = time.perf_counter()
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    conn = connect(db_path, isolation_level=None)
+    try:
+        previous = {
+            pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in LOAD_PRAGMAS
+        }
+        for pragma, value in LOAD_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma}={value}")
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode != "wal":
+            conn.execute("PRAGMA journal_mode=MEMORY")
+
+        count = 0
+        rows = iter(rows)
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(sql, chunk)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            count += len(chunk)
+
+        for ddl in indexes:
+            conn.execute(ddl)
+
+        if journal_mode != "wal":
+            conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        for pragma, value in previous.items():
+            conn.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        conn.close()
+    return LoadStats(count, time.perf_counter() - start)
+
+
+def read_csv(path, columns=None):
+    """Yield rows of a CSV file with a header line, as tuples in `columns` order."""
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        columns = columns or reader.fieldnames
+        for record in reader:
+            yield tuple(record[c] for c in columns)
+
+
+def read_jsonl(path, columns):
+    """Yield rows of a JSON Lines file as tuples in `columns` order."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield tuple(record.get(c) for c in columns)
+
+
+def iter_chunks(conn: sqlite3.Connection, sql: str, params=(), chunk_size: int = 1000):
+    """
+    Yield the results of `sql` in lists of at most `chunk_size` rows, so only one
+    chunk is in memory at a time. The statement stays open, and so holds its
+    SHARED lock, until the last chunk has been read; see `iter_keyset` for
+    queries that should not.
+    """
+    cursor = conn.execute(sql, params)
+    try:
+        while chunk := cursor.fetchmany(chunk_size):
+            yield chunk
+    finally:
+        cursor.close()
+
+
+def iter_keyset(
+    conn: sqlite3.Connection,
+    table: str,
+    columns=("*",),
+    key: str = "id",
+    chunk_size: int = 1000,
+):
+    """
+    Yield all rows of `table` in `key` order, in lists of at most `chunk_size`
+    rows. Each chunk is a separate `SELECT ... WHERE key > ? LIMIT ?`, i.e. its
+    own short read transaction, so neither memory use nor lock hold time grows
+    with the table. `key` must be unique and indexed, and one of the selected
+    `columns` (as it is with "*" and an `id` primary key).
+
+    Rows inserted or deleted between chunks may or may not be seen.
+    """
+    select = f"SELECT {', '.join(columns)} FROM {table}"
+    cursor = conn.execute(f"{select} ORDER BY {key} LIMIT ?", (chunk_size,))
+    names = [description[0].lower() for description in cursor.description]
+    if key.lower() not in names:
+        raise ValueError(f"columns must include the key column {key!r}, got {names}")
+    # The next chunk starts after the last row's key
+    index = names.index(key.lower())
+    chunk = cursor.fetchall()
+    while chunk:
+        yield chunk
+        chunk = conn.execute(
+            f"{select} WHERE {key} > ? ORDER BY {key} LIMIT ?", (chunk[-1][index], chunk_size)
+        ).fetchall()
+
+
+def write_chunks(chunks, columns=None, max_rows=10_000, **dataframe_kwargs):
+    """
+    Render chunks from `iter_chunks`/`iter_keyset` in Streamlit as they arrive,
+    redrawing a single `st.dataframe` placeholder with the rows so far. Stops
+    reading after `max_rows`, so the server holds at most that many rows.
+    """
+    import streamlit as st
+
+    placeholder = st.empty()
+    rows = []
+    placeholder.dataframe(_frame(rows, columns), **dataframe_kwargs)
+    for chunk in chunks:
+        rows.extend(chunk[: max_rows - len(rows)])
+        placeholder.dataframe(_frame(rows, columns), **dataframe_kwargs)
+        if len(rows) >= max_rows:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            st.caption(f"Showing the first {max_rows:,} rows.")
+            break
+
+
+def _frame(rows, columns):
+    import pandas as pd
+
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
 conn_from_another_file = sqlite3.Connection(
     f"file:connection_in_another_file?mode=memory&cache=shared", check_same_thread=False
 )
+
+
+class ConnectionPool:
+    """
+    `readers` read-only connections plus a single write connection to a WAL-mode database.
+
+    WAL lets the readers run concurrently with each other and with the writer,
+    instead of serializing on one shared connection's mutex. A thread is handed
+    back the reader it last used whenever it is idle, so its prepared statement
+    cache stays warm.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        readers: int = 4,
+        cached_statements: int = 256,
+        storage_profile: str = None,
+    ):
+        self.db_path = db_path
+        self._write_conn = connect(db_path, storage_profile, check_same_thread=False)
+        self._write_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_lock = threading.Lock()
+
+        self._idle = []
+        self._idle_changed = threading.Condition()
+        self._local = threading.local()
+        for _ in range(readers):
+            conn = connect(
+                f"file:{Path(db_path).resolve()}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+                cached_statements=cached_statements,
+                storage_profile=storage_profile,
+            )
+            conn.execute("PRAGMA query_only=ON")
+            self._idle.append(conn)
+        self._all = list(self._idle)
+
+    @contextmanager
+    def reader(self):
+        """Check out a read-only connection for the current thread."""
+        with self._idle_changed:
+            self._idle_changed.wait_for(lambda: self._idle)
+            last = getattr(self._local, "conn", None)
+            conn = last if last in self._idle else self._idle[-1]
+            self._idle.remove(conn)
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._idle_changed:
+                self._idle.append(conn)
+                self._idle_changed.notify()
+
+    @contextmanager
+    def writer(self):
+        """Exclusive use of the write connection. Commits on success, rolls back on error."""
+        with self._write_lock:
+            try:
+                yield self._write_conn
+                self._write_conn.commit()
+            except BaseException:
+                self._write_conn.rollback()
+                raise
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+        self._write_conn.close()
+
+
+class ConnectionManager:
+    """
+    Long-lived connections, shared between threads, for the whole server lifetime.
+
+    Streamlit reruns a page's script on every interaction, so a connection opened
+    in the script is reopened (and its PRAGMAs and schema re-parsed) each time,
+    while one imported from a module is shared by every thread (see
+    pages/8_Appendix:_Streamlit_Threads_and_Connections.py). Instead, `get`
+    checks a connection out of an idle list for the calling thread, and the
+    thread keeps it until it exits, which for Streamlit is when the script run
+    ends; the connection then goes back to the idle list, with any transaction
+    the run left open rolled back. `prewarm` connections are opened and
+    configured up front. A connection that no longer works is replaced on
+    checkout.
+    """
+
+    def __init__(
+        self, database, prewarm: int = 4, storage_profile: str = None, **connect_kwargs
+    ):
+        self.database = database
+        self.storage_profile = storage_profile
+        self.connect_kwargs = {"check_same_thread": False, **connect_kwargs}
+        self.reconnects = 0
+        self._local = threading.local()
+        self._idle = [self._connect() for _ in range(prewarm)]
+        self._idle_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = connect(self.database, self.storage_profile, **self.connect_kwargs)
+        # Parse the schema now rather than on the first query
+        conn.execute("SELECT count(*) FROM sqlite_schema").fetchone()
+        return conn
+
+    def get(self) -> sqlite3.Connection:
+        """The calling thread's connection, checked out on its first call."""
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            with self._idle_lock:
+                conn = self._idle.pop() if self._idle else None
+            lease = self._local.lease = _Lease(conn or self._connect())
+            # Thread-local values are freed when their thread exits
+            weakref.finalize(lease, self._release, lease.box)
+        conn = lease.box[0]
+        if not self._healthy(conn):
+            self.reconnects += 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            conn = lease.box[0] = self._connect()
+        return conn
+
+    def _release(self, box):
+        conn = box[0]
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Replaced on its next checkout
+            pass
+        with self._idle_lock:
+            self._idle.append(conn)
+
+    @staticmethod
+    def _healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+
+class _Lease:
+    """A thread's checked-out connection, in a box the release callback can see."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.box = [conn]
+
+
+_cached_connection_manager = None
+
+
+def _connection_manager(database: str, prewarm: int, storage_profile: str):
+    return ConnectionManager(database, prewarm, storage_profile)
+
+
+def streamlit_connection(
+    database, prewarm: int = 4, storage_profile: str = None
+) -> sqlite3.Connection:
+    """
+    The current thread's connection to `database`, from a `ConnectionManager`
+    kept in `st.cache_resource` so that it is shared by every session. The
+    first call in the server process creates the manager, and opens its
+    `prewarm` connections; later calls, from any session, reuse them.
+    """
+    global _cached_connection_manager
+    if _cached_connection_manager is None:
+        # Imported here so that non-Streamlit users of this module don't pay for it
+        import streamlit as st
+
+        _cached_connection_manager = st.cache_resource(_connection_manager)
+    return _cached_connection_manager(str(database), prewarm, storage_profile).get()
+
+
+class Writer:
+    """
+    Owns the only write connection to `db_path`, on a dedicated thread.
+
+    Other threads `submit()` jobs and wait on the returned futures. Jobs queued
+    within `commit_window` seconds of each other are run in a single
+    `BEGIN IMMEDIATE` transaction (group commit), so many small writes share
+    one lock acquisition and one fsync. Each job runs in its own savepoint,
+    so a failing job is rolled back without affecting the rest of the batch.
+
+    Futures only resolve once the batch has been committed. The connection is
+    opened in the constructor, so a bad `db_path` raises there; if the writer
+    thread dies, queued and later jobs fail with its exception.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        commit_window: float = 0.005,
+        max_batch: int = 1000,
+        storage_profile: str = None,
+    ):
+        self.db_path = db_path
+        self.storage_profile = storage_profile
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        # Transactions are managed explicitly below, so disable the driver's implicit BEGIN
+        self._conn = connect(
+            db_path, storage_profile, isolation_level=None, check_same_thread=False
+        )
+        self._jobs = queue.SimpleQueue()
+        self._closed = None
+        self._closed_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args) -> Future:
+        """Run `fn(conn, *args)` on the writer thread, inside a write transaction."""
+        future = Future()
+        with self._closed_lock:
+            if self._closed is not None:
+                raise RuntimeError("Writer is closed") from self._closed
+            self._jobs.put((fn, args, future))
+        return future
+
+    def execute(self, sql: str, params=()) -> Future:
+        """Queue a single statement. The future resolves to its `fetchall()` rows."""
+        return self.submit(lambda conn: conn.execute(sql, params).fetchall())
+
+    def close(self):
+        """Flush queued jobs, then stop the writer thread and close its connection."""
+        with self._closed_lock:
+            if self._closed is None:
+                self._closed = RuntimeError("Writer is closed")
+                self._jobs.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        batch = [self._jobs.get()]
+        deadline = time.monotonic() + self.commit_window
+        while batch[-1] is not None and len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = self._conn
+        batch = []
+        try:
+            while True:
+                batch = self._next_batch()
+                stop = batch[-1] is None
+                jobs = batch[:-1] if stop else batch
+                if jobs:
+                    self._commit(conn, jobs)
+                if stop:
+                    break
+        except BaseException as e:
+            with self._closed_lock:
+                self._closed = e
+            jobs = list(batch)
+            while not self._jobs.empty():
+                jobs.append(self._jobs.get())
+            for job in jobs:
+                if job is None or job[2].done():
+                    continue
+                if job[2].running() or job[2].set_running_or_notify_cancel():
+                    job[2].set_exception(e)
+            raise
+        finally:
+            conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, jobs):
+        jobs = [job for job in jobs if job[2].set_running_or_notify_cancel()]
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in jobs:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((future, fn(conn, *args), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    if not conn.in_transaction:
+                        # SQLite rolled back the whole transaction (e.g. disk full)
+                        raise
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, future in jobs:
+                future.set_exception(e)
+            return
+
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+
+def create_user_if_not_exists(writer: Writer, email: str) -> int:
+    """
+    The per-request upsert from the app (see pages/1_The_App.py), via the writer
+    thread, on a database with `APP_USERS_SCHEMA`.
+    """
+    rows = writer.execute(
+        """
+        INSERT INTO users (email)
+            VALUES (?)
+            ON CONFLICT(email)
+            DO UPDATE SET email=excluded.email
+        RETURNING id;
+        """,
+        (email,),
+    ).result()
+    return rows[0][0]
+
+
+class UserIdCache:
+    """
+    Bounded LRU cache of email -> user id in front of `create_user_if_not_exists`.
+
+    On a miss, the id is first looked up with a `SELECT` on a pooled read-only
+    connection, which in WAL mode takes no write lock. Only emails not in the
+    database at all go through the writer. Safe to share between threads.
+    """
+
+    def __init__(self, pool: ConnectionPool, writer: Writer, maxsize: int = 10_000):
+        self.pool = pool
+        self.writer = writer
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, email: str) -> int:
+        with self._lock:
+            id = self._ids.get(email)
+            if id is not None:
+                self._ids.move_to_end(email)
+                self.hits += 1
+                return id
+            self.misses += 1
+
+        with self.pool.reader() as conn:
+            row = conn.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()
+        if row is not None:
+            id = row[0]
+        else:
+            id = create_user_if_not_exists(self.writer, email)
+
+        with self._lock:
+            if row is None:
+                self.inserts += 1
+            self._ids[email] = id
+            self._ids.move_to_end(email)
+            if len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+        return id
+
+    def invalidate(self, email: str = None):
+        """Forget `email` (e.g. after deleting the user), or everything."""
+        with self._lock:
+            if email is None:
+                self._ids.clear()
+            else:
+                self._ids.pop(email, None)